@@ -0,0 +1,49 @@
+# Copyright Aaron Stanek 2021
+# See LICENSE for more details
+
+# compares two reports written by run.py or python -m passutil --bench
+# python compare.py OLD NEW [--threshold T]
+# prints the change in chars/sec for each case found in both reports
+# exits with 1 if any case got slower by more than the threshold,
+# or if both reports were run with the same --seed and a case's passwords changed
+
+import argparse
+import json
+
+def case_key(result):
+    return (result["engine"],result["charset"],result["length"],result["mode"],result["backend"],result["sampler"])
+
+def load_report(path):
+    # returns the report's seed, or None if it wasn't seeded,
+    # and its results by case
+    with open(path) as file:
+        report = json.load(file)
+    return report.get("seed"), {case_key(result): result for result in report["results"]}
+
+def main():
+    parser = argparse.ArgumentParser(description="compare two passutil benchmark reports")
+    parser.add_argument("old")
+    parser.add_argument("new")
+    parser.add_argument("--threshold",type=float,default=0.1,help="the largest acceptable slowdown, as a fraction")
+    args = parser.parse_args()
+    old_seed, old = load_report(args.old)
+    new_seed, new = load_report(args.new)
+    # digests can only be compared between reports with the same seed
+    same_seed = old_seed is not None and old_seed == new_seed
+    regressions = 0
+    for key in old:
+        if key not in new:
+            continue
+        change = new[key]["chars_per_second"] / old[key]["chars_per_second"] - 1
+        flag = ""
+        if change < -args.threshold:
+            flag = "  REGRESSION"
+            regressions += 1
+        if same_seed and "digest" in old[key] and "digest" in new[key] and old[key]["digest"] != new[key]["digest"]:
+            flag += "  OUTPUT CHANGED"
+            regressions += 1
+        print("{:<60} {:+7.1%}{}".format(" ".join(map(str,key)),change,flag))
+    return 1 if regressions > 0 else 0
+
+if __name__ == "__main__":
+    raise SystemExit(main())
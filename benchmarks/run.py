@@ -0,0 +1,52 @@
+# Copyright Aaron Stanek 2021
+# See LICENSE for more details
+
+# runs the benchmark suite, and writes the results as JSON
+# python run.py [--quick] [--min-seconds S] [--output FILE] [--seed SEED]
+# --quick runs the same sweep as python -m passutil --bench
+# otherwise every charset is run at every length,
+# and every backend in every mode with every engine
+# --seed draws from a DeterministicSource instead of the OS,
+# skips the parallel engine, and records a digest of each case's passwords
+
+import argparse
+import itertools
+import json
+import sys
+sys.path.append("../src")
+import passutil.bench as bench
+
+# lengths from a short password up to a 1M character key
+SUITE_LENGTHS = (8,16,64,1024,65536,1048576)
+
+def suite_cases():
+    cases = []
+    for valid_chars, length in itertools.product(bench.BENCH_CHARSETS,SUITE_LENGTHS):
+        cases.append({"engine": "generator", "length": length, "valid_chars": valid_chars,
+            "mode": "standard", "backend": None, "sampler": "byte"})
+    for backend, mode, engine in itertools.product(bench.hash_backends,bench.BENCH_MODES,bench.BENCH_ENGINES):
+        cases.append({"engine": engine, "length": 16, "valid_chars": "z",
+            "mode": mode, "backend": backend, "sampler": "byte"})
+    for valid_chars, mode in itertools.product(bench.BENCH_CHARSETS,bench.BENCH_MODES):
+        cases.append({"engine": "generator", "length": 16, "valid_chars": valid_chars,
+            "mode": mode, "backend": None, "sampler": "index"})
+    return cases
+
+def main():
+    parser = argparse.ArgumentParser(description="passutil benchmark suite")
+    parser.add_argument("--quick",action="store_true",help="run the sweep used by python -m passutil --bench")
+    parser.add_argument("--min-seconds",type=float,default=bench.BENCH_MIN_SECONDS,help="the minimum time spent on each case")
+    parser.add_argument("--output",default=None,help="write the JSON report to this file instead of stdout")
+    parser.add_argument("--seed",default=None,help="generate reproducible passwords from this seed, for testing only")
+    args = parser.parse_args()
+    cases = bench.sweep() if args.quick else suite_cases()
+    report = bench.run_benchmarks(cases,args.min_seconds,progress=lambda result: print(json.dumps(result),file=sys.stderr),seed=args.seed)
+    text = json.dumps(report,indent=2)
+    if args.output is None:
+        print(text)
+    else:
+        with open(args.output,"w") as file:
+            file.write(text+"\n")
+
+if __name__ == "__main__":
+    main()
@@ -1,5 +1,85 @@
 # Copyright Aaron Stanek 2021
 # See LICENSE for more details
 
-from .pu import SHA512_number, generate_password
-from .chars import charset_size
\ No newline at end of file
+import sys
+
+# exports maps each public name to the module which defines it
+# the modules are imported the first time one of their names is used,
+# so that python -m passutil --size doesn't pay for hashlib,
+# multiprocessing, or asyncio
+exports = {
+    "SHA512_number": "backends",
+    "hash_backend": "backends",
+    "hash_backends": "backends",
+    "generate_password": "pu",
+    "generate_passwords": "pu",
+    "PasswordGenerator": "pu",
+    "iter_password_chars": "pu",
+    "generate_password_into": "pu",
+    "charset_size": "chars",
+    "rejection_rate": "chars",
+    "Charset": "chars",
+    "compile_charset": "chars",
+    "charset_cache_info": "chars",
+    "generate_passwords_parallel": "parallel",
+    "iter_passwords_parallel": "parallel",
+    "ThreadSafeGenerator": "threadsafe",
+    "agenerate_password": "aio",
+    "agenerate_passwords": "aio",
+    "aiter_passwords": "aio",
+    "aiter_password_chars": "aio",
+    "PasswordPool": "pool",
+    "enable_stats": "stats",
+    "disable_stats": "stats",
+    "get_stats": "stats",
+    "reset_stats": "stats",
+    "Wordlist": "words",
+    "PassphraseGenerator": "words",
+    "generate_passphrase": "words",
+    "generate_passphrases": "words",
+    "Policy": "policy",
+    "AMBIGUOUS_CHARS": "policy",
+    "serve": "server",
+    "start_server": "server",
+    "request_password": "client",
+    "request_passwords": "client",
+    "EntropySource": "entropy",
+    "SystemSource": "entropy"
+}
+
+# submodules are imported the first time they are used
+# as attributes, as in passutil.chars, the same as when
+# they were imported with the package
+submodules = ("aio","backends","bench","chars","client","entropy","parallel","policy","pool","pu","server","stats","testing","threadsafe","words")
+
+# from passutil import * imports every public name,
+# which also imports every module
+__all__ = list(exports)
+
+if sys.version_info >= (3,7):
+    import importlib
+    def __getattr__(name):
+        if name in submodules:
+            return importlib.import_module("."+name,__name__)
+        if name not in exports:
+            raise AttributeError("module 'passutil' has no attribute "+repr(name))
+        value = getattr(importlib.import_module("."+exports[name],__name__),name)
+        globals()[name] = value
+        return value
+    def __dir__():
+        return sorted(set(globals()) | set(exports) | set(submodules))
+else:
+    # Python 3.6 has no module __getattr__
+    from .backends import SHA512_number, hash_backend, hash_backends
+    from .pu import generate_password, generate_passwords, PasswordGenerator, iter_password_chars, generate_password_into
+    from .chars import charset_size, rejection_rate, Charset, compile_charset, charset_cache_info
+    from .parallel import generate_passwords_parallel, iter_passwords_parallel
+    from .threadsafe import ThreadSafeGenerator
+    from .aio import agenerate_password, agenerate_passwords, aiter_passwords, aiter_password_chars
+    from .pool import PasswordPool
+    from .stats import enable_stats, disable_stats, get_stats, reset_stats
+    from .words import Wordlist, PassphraseGenerator, generate_passphrase, generate_passphrases
+    from .policy import Policy, AMBIGUOUS_CHARS
+    from .server import serve, start_server
+    from .client import request_password, request_passwords
+    from .entropy import EntropySource, SystemSource
\ No newline at end of file
@@ -1,50 +1,242 @@
 # Copyright Aaron Stanek 2021
 # See LICENSE for more details
 
+import os
 import sys
-from .pu import SHA512_number, generate_password
 from .chars import charset_size
 
+# the rest of passutil is imported only by the commands which need it,
+# so that --size and --client never import hashlib, and --hash only imports hashlib
+
+# the size of the buffer used when writing to a file given with --output
+OUTPUT_BUFFER_SIZE = 65536
+
+# the number of passphrases written at a time
+PASSPHRASE_BATCH_SIZE = 1000
+
+class Message(Exception):
+    # not an error
+    # the text is written to stdout, and the exit code is 0
+    pass
+
+def parse_integer(value,name):
+    try:
+        return int(value)
+    except:
+        raise TypeError(name+" parameter should be an integer")
+
+def report_progress(result):
+    print("{engine} {charset} {length} {mode} {backend} {sampler}: {passwords_per_second:.0f} passwords/s, {chars_per_second:.0f} chars/s".format(**result),file=sys.stderr)
+
 def load_command_line_parameters():
     if len(sys.argv) < 2:
         # user did not give any input
         # display a welcome message
-        raise Exception(
+        raise Message(
             "Python Password Utility 3.0.5\n"
             "Cryptographically secure, easy-to-use, password generator\n"
             "Full documentation at: https://github.com/aaronstanek/PythonPasswordUtility\n"
             "Copyright Aaron Stanek 2021")
-    elif sys.argv[1] == "--hash":
+    elif sys.argv[1] == "--hash" and len(sys.argv) < 3:
         # user entered --hash
         # tell them which version of SHA512 we are using
-        raise Exception("Using SHA-"+str(SHA512_number)+" 512")
+        # and which other backends may be selected
+        from .backends import SHA512_number, hash_backend, hash_backends
+        raise Message(
+            "Using SHA-"+str(SHA512_number)+" 512 ("+hash_backend+")\n"
+            "Available: "+", ".join(hash_backends))
     elif sys.argv[1] == "--size":
         # user entered --size
         # check if there is another parameter after --size
         if len(sys.argv) < 3:
-            raise Exception("expected valid_chars parameter after --size")
+            raise ValueError("expected valid_chars parameter after --size")
         # treat it like a charstring
         # then give the size of the resulting charset
-        raise Exception(str(charset_size(sys.argv[2])))
-    elif len(sys.argv) < 3:
+        raise Message(str(charset_size(sys.argv[2])))
+    elif sys.argv[1] == "--bench":
+        # user entered --bench
+        # run the benchmark sweep, reporting progress on stderr,
+        # and give the results as JSON
+        import json
+        from .bench import run_benchmarks
+        report = run_benchmarks(progress=report_progress)
+        raise Message(json.dumps(report,indent=2))
+    backend = None
+    count = 1
+    output = None
+    separator = "\n"
+    workers = None
+    wordlist = None
+    joiner = " "
+    client = None
+    use_client = False
+    args = sys.argv[1:]
+    # options come before <valid_chars>
+    while len(args) > 0 and args[0].startswith("--"):
+        option = args[0]
+        if option == "--null":
+            # separate the passwords with NUL instead of newline
+            # for use with xargs -0
+            separator = "\0"
+            args = args[1:]
+            continue
+        if option == "--client":
+            # ask the server started by --serve for the passwords
+            use_client = True
+            args = args[1:]
+            continue
+        if option not in ("--hash","--count","--output","--workers","--words","--separator","--socket"):
+            raise ValueError("unknown option "+option)
+        if len(args) < 2:
+            raise ValueError("expected a value after "+option)
+        value = args[1]
+        args = args[2:]
+        if option == "--hash":
+            # user entered --hash <backend>
+            # generate the password with that backend
+            from .backends import hash_backends
+            if value not in hash_backends:
+                raise ValueError("unknown hash backend, expected one of: "+", ".join(hash_backends))
+            backend = value
+        elif option == "--count":
+            count = parse_integer(value,"count")
+            if count < 0:
+                raise ValueError("count parameter must be nonnegative")
+        elif option == "--output":
+            output = value
+        elif option == "--words":
+            # user entered --words <wordlist>
+            # generate passphrases instead of passwords
+            wordlist = value
+        elif option == "--separator":
+            # the text between the words of a passphrase
+            joiner = value
+        elif option == "--socket":
+            # the path of the server's socket, implies --client
+            client = value
+        else:
+            workers = parse_integer(value,"workers")
+            if workers < 1:
+                raise ValueError("workers parameter has minimum 1")
+    if use_client and client is None:
+        from .client import default_socket_path
+        client = default_socket_path()
+    if client is not None:
+        if wordlist is not None:
+            raise ValueError("--words is not supported with --client")
+        if workers is not None:
+            raise ValueError("--workers is not supported with --client")
+        if backend is not None:
+            raise ValueError("--hash is chosen by the server with --serve")
+    if wordlist is not None:
+        # passphrases have no <valid_chars>,
+        # the length is the number of words
+        if len(args) < 1:
+            raise ValueError("not enough command line parameters")
+        if workers is not None:
+            raise ValueError("--workers is not supported with --words")
+        args = [None] + args
+    if len(args) < 2:
         raise ValueError("not enough command line parameters")
     # there is at least charset and length
-    valid_chars = sys.argv[1]
-    try:
-        # we expect the length to be a valid integer
-        length = int(sys.argv[2])
-    except:
-        raise TypeError("length parameter should be an integer")
+    valid_chars = args[0]
+    # we expect the length to be a valid integer
+    length = parse_integer(args[1],"length")
     key = str(sys.argv)
-    return valid_chars, length, key
+    return valid_chars, length, key, backend, count, output, separator, workers, wordlist, joiner, client
+
+def serve_command(args):
+    # python -m passutil --serve [--socket <path>] [--hash <backend>]
+    # runs until interrupted
+    path = None
+    backend = None
+    while len(args) > 0:
+        if args[0] not in ("--socket","--hash"):
+            raise ValueError("unknown option "+args[0]+" for --serve")
+        if len(args) < 2:
+            raise ValueError("expected a value after "+args[0])
+        if args[0] == "--socket":
+            path = args[1]
+        else:
+            backend = args[1]
+        args = args[2:]
+    from .server import serve
+    serve(str(sys.argv),path,backend)
+
+def iter_batches(count,length,key,charset,backend,workers):
+    # yields lists of passwords, count passwords in total
+    if workers is not None:
+        from .parallel import iter_passwords_parallel
+        yield from iter_passwords_parallel(count,length,key,charset,workers,backend=backend)
+        return
+    from .pu import PasswordGenerator, STREAM_CHUNK_SIZE
+    generator = PasswordGenerator(key,charset,backend=backend)
+    # each batch is about STREAM_CHUNK_SIZE characters
+    batch_size = max(1,STREAM_CHUNK_SIZE // max(1,length))
+    while count > 0:
+        n = min(batch_size,count)
+        yield generator.next_passwords(n,length)
+        count -= n
+
+def iter_passphrase_batches(count,words,key,wordlist,joiner,backend):
+    # yields lists of passphrases, count passphrases in total
+    # wordlist is closed once the passphrases are done
+    from .words import PassphraseGenerator
+    try:
+        generator = PassphraseGenerator(key,wordlist,backend=backend)
+        while count > 0:
+            n = min(PASSPHRASE_BATCH_SIZE,count)
+            yield generator.next_passphrases(n,words,joiner)
+            count -= n
+    finally:
+        wordlist.close()
+
+def write_passwords(stream,batches,separator):
+    # writes each batch with a single call,
+    # rather than one call per password
+    for batch in batches:
+        if len(batch) > 0:
+            stream.write((separator.join(batch)+separator).encode("UTF-8"))
 
 def main():
     try:
-        valid_chars, length, key = load_command_line_parameters()
-        password = generate_password(length, key, valid_chars)
-        print(password)
+        if len(sys.argv) > 1 and sys.argv[1] == "--serve":
+            serve_command(sys.argv[2:])
+            return 0
+        valid_chars, length, key, backend, count, output, separator, workers, wordlist, joiner, client = load_command_line_parameters()
+        if client is not None:
+            # the server validates the request,
+            # and nothing here imports hashlib
+            from .client import request_passwords
+            batches = [request_passwords(count,length,valid_chars,key,client)]
+        elif wordlist is None:
+            from .pu import check_length, prepare_charset
+            # validate everything before the output file is opened
+            check_length(length)
+            charset = prepare_charset(valid_chars)
+            batches = iter_batches(count,length,key,charset,backend,workers)
+        else:
+            from .pu import check_length
+            from .words import Wordlist
+            check_length(length)
+            batches = iter_passphrase_batches(count,length,key,Wordlist(wordlist),joiner,backend)
+        if output is None:
+            write_passwords(sys.stdout.buffer,batches,separator)
+            sys.stdout.flush()
+        else:
+            with open(output,"wb",buffering=OUTPUT_BUFFER_SIZE) as stream:
+                write_passwords(stream,batches,separator)
+    except Message as message:
+        print(message)
+    except BrokenPipeError:
+        # the reader went away, as in: python -m passutil --count 1000000 z 16 | head
+        # point stdout at devnull, so that the final flush doesn't fail too
+        os.dup2(os.open(os.devnull,os.O_WRONLY),sys.stdout.fileno())
+        return 1
     except Exception as ex:
-        print(ex)
+        print(ex,file=sys.stderr)
+        return 1
+    return 0
 
 if __name__ == "__main__":
-    main()
+    sys.exit(main())
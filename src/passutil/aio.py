@@ -0,0 +1,93 @@
+# Copyright Aaron Stanek 2021
+# See LICENSE for more details
+
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from .pu import PasswordGenerator, check_length, STREAM_CHUNK_SIZE
+
+# the number of threads in the executor
+# used when none is given
+ASYNC_WORKERS = 4
+
+# the number of characters generated in a single call to the executor
+# the event loop can cancel the work, or stop asking for more,
+# between each of these batches
+ASYNC_BATCH_SIZE = STREAM_CHUNK_SIZE
+
+default_executor = None
+
+def get_executor(executor):
+    # returns executor, or the shared default executor
+    # the default executor is created on first use,
+    # and bounds the number of threads doing the work
+    global default_executor
+    if executor is not None:
+        return executor
+    if default_executor is None:
+        default_executor = ThreadPoolExecutor(max_workers=ASYNC_WORKERS,thread_name_prefix="passutil")
+    return default_executor
+
+async def run(executor,function,*args):
+    # runs function(*args) in executor, without blocking the event loop
+    loop = asyncio.get_event_loop()
+    return await loop.run_in_executor(get_executor(executor),function,*args)
+
+def batch_count(length):
+    # the number of passwords of the given length
+    # which fit in a single batch
+    return max(1,ASYNC_BATCH_SIZE // max(1,length))
+
+async def agenerate_password(length,key,valid_chars,mode="standard",backend=None,sampler="byte",executor=None):
+    # the same as generate_password, but awaitable
+    # long passwords are generated in batches
+    check_length(length)
+    generator = await run(executor,PasswordGenerator,key,valid_chars,mode,backend,sampler)
+    chunks = []
+    remaining = length
+    while remaining > 0:
+        n = min(ASYNC_BATCH_SIZE,remaining)
+        chunks.append(await run(executor,generator.next_bytes,n))
+        remaining -= n
+    return b''.join(chunks).decode("UTF-8")
+
+async def agenerate_passwords(count,length,key,valid_chars,mode="standard",backend=None,sampler="byte",executor=None):
+    # the same as generate_passwords, but awaitable
+    passwords = []
+    async for password in aiter_passwords(count,length,key,valid_chars,mode,backend,sampler,executor):
+        passwords.append(password)
+    return passwords
+
+async def aiter_passwords(count,length,key,valid_chars,mode="standard",backend=None,sampler="byte",executor=None):
+    # asynchronously yields count passwords of the given length
+    # if count is None, the passwords never stop coming
+    # the next batch is only generated once the current one has
+    # been consumed, so a slow consumer is never buried in passwords
+    if count is not None:
+        check_length(count,"count")
+    check_length(length)
+    generator = await run(executor,PasswordGenerator,key,valid_chars,mode,backend,sampler)
+    produced = 0
+    while count is None or produced < count:
+        n = batch_count(length)
+        if count is not None:
+            n = min(n,count-produced)
+        batch = await run(executor,generator.next_passwords,n,length)
+        produced += n
+        for password in batch:
+            yield password
+
+async def aiter_password_chars(key,valid_chars,chunk_size=STREAM_CHUNK_SIZE,length=None,binary=False,mode="standard",backend=None,sampler="byte",executor=None):
+    # the same as iter_password_chars, but asynchronous
+    # each chunk is generated in the executor when it is requested
+    check_length(chunk_size,"chunk_size")
+    if chunk_size < 1:
+        raise ValueError("chunk_size parameter has minimum 1")
+    if length is not None:
+        check_length(length)
+    generator = await run(executor,PasswordGenerator,key,valid_chars,mode,backend,sampler)
+    produced = 0
+    while length is None or produced < length:
+        n = chunk_size if length is None else min(chunk_size,length-produced)
+        chunk = await run(executor,generator.next_bytes,n)
+        produced += n
+        yield chunk if binary else chunk.decode("UTF-8")
@@ -0,0 +1,78 @@
+# Copyright Aaron Stanek 2021
+# See LICENSE for more details
+
+# the hash backends are kept apart from pu.py,
+# so that python -m passutil --hash only needs hashlib
+
+import hashlib
+
+# try to use SHA-3 if possible
+# default to SHA-2 if you have to
+
+if "sha3_512" in hashlib.algorithms_available:
+    SHA512 = lambda x : hashlib.sha3_512(x).digest()
+    SHA512_number = 3
+else:
+    SHA512 = lambda x : hashlib.sha512(x).digest()
+    SHA512_number = 2
+
+class HashBackend(object):
+    # wraps a hashlib constructor with a 64 byte output
+    # keyed backends take the key as a parameter of the hash
+    # function, others have it appended to the input
+    def __init__(self,name,constructor,keyed):
+        self.name = name
+        self.constructor = constructor
+        self.keyed = keyed
+    def __repr__(self):
+        return "HashBackend(" + repr(self.name) + ")"
+    def digest(self,data):
+        return self.constructor(data).digest()
+    def prepare_key(self,key):
+        # BLAKE2b accepts keys of at most 64 bytes
+        # longer keys are compressed with the hash itself
+        if self.keyed and len(key) > 64:
+            return self.constructor(b'key:' + key).digest()
+        return key
+    def state(self,prefix):
+        # returns a hash object which has absorbed prefix
+        return self.constructor(prefix)
+    def keyed_state(self,prefix,key):
+        # returns a hash object which has absorbed prefix and key
+        # key should have been passed through prepare_key
+        if self.keyed:
+            return self.constructor(prefix,key=key)
+        # the key is absorbed up front, after its length,
+        # so that it does not need to be hashed again at every step
+        h = self.constructor(prefix)
+        h.update(len(key).to_bytes(8,"big"))
+        h.update(key)
+        return h
+
+# hash_backends maps backend names to backends
+# sha512 and blake2b are always provided by hashlib
+
+hash_backends = {}
+if "sha3_512" in hashlib.algorithms_available:
+    hash_backends["sha3_512"] = HashBackend("sha3_512",hashlib.sha3_512,False)
+hash_backends["sha512"] = HashBackend("sha512",hashlib.sha512,False)
+hash_backends["blake2b"] = HashBackend("blake2b",hashlib.blake2b,True)
+
+# hash_backend is the name of the backend
+# used when none is specified
+# it is the backend described by SHA512_number
+
+hash_backend = "sha3_512" if SHA512_number == 3 else "sha512"
+
+def resolve_backend(backend):
+    # backend may be None, a backend name, or a HashBackend
+    # returns a HashBackend
+    if backend is None:
+        return hash_backends[hash_backend]
+    if isinstance(backend,HashBackend):
+        return backend
+    if type(backend) != str:
+        raise TypeError("backend parameter must be str or None")
+    if backend not in hash_backends:
+        raise ValueError("backend parameter must be one of: "+", ".join(hash_backends))
+    return hash_backends[backend]
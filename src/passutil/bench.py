@@ -0,0 +1,144 @@
+# Copyright Aaron Stanek 2021
+# See LICENSE for more details
+
+import hashlib
+import platform
+import sys
+import time
+from .pu import SHA512_number, generate_password, generate_passwords, check_length, check_option, hash_backend, hash_backends
+from .chars import charset_size
+from .parallel import generate_passwords_parallel
+from .testing import DeterministicSource
+
+# the ways of generating many passwords
+# single: one call to generate_password per password,
+#   which pays for the setup every time
+# generator: one call to generate_passwords,
+#   which shares the setup between the passwords
+# parallel: one call to generate_passwords_parallel
+engines = ("single","generator","parallel")
+
+# each case runs for at least this many seconds
+BENCH_MIN_SECONDS = 0.5
+
+# the cases run by python -m passutil --bench
+# the baseline is the first entry of each list,
+# and each case varies one of them
+# 3, 37, and 83 are awkward sizes for the samplers
+BENCH_CHARSETS = ("z","n","h","a","iabc","lni_","zr")
+BENCH_LENGTHS = (16,8,64,1024)
+BENCH_MODES = ("standard","high_yield","shake","batched")
+BENCH_SAMPLERS = ("byte","index")
+BENCH_ENGINES = ("generator","single","parallel")
+
+# the number of passwords in the digest of a seeded case
+BENCH_DIGEST_COUNT = 64
+
+def engine_function(engine,length,valid_chars,mode,backend,sampler,seed=None):
+    # returns a function of count, which generates count passwords
+    # if seed is given, each call draws from a new DeterministicSource,
+    # so that the OS random number generator and clocks are left out,
+    # and every call with the same count gives the same passwords
+    key = "passutil benchmark"
+    def source():
+        return None if seed is None else DeterministicSource(seed)
+    if engine == "single":
+        def single(count):
+            shared = source()
+            return [generate_password(length,key,valid_chars,mode,backend,sampler,source=shared) for i in range(count)]
+        return single
+    if engine == "generator":
+        return lambda count: generate_passwords(count,length,key,valid_chars,mode,backend,sampler,source=source())
+    if seed is not None:
+        raise ValueError("the parallel engine draws entropy in each worker, and cannot be seeded")
+    return lambda count: generate_passwords_parallel(count,length,key,valid_chars,mode=mode,backend=backend,sampler=sampler)
+
+def bench_case(engine,length,valid_chars,mode="standard",backend=None,sampler="byte",min_seconds=BENCH_MIN_SECONDS,seed=None):
+    # measures a single case
+    # the number of passwords doubles each round,
+    # until min_seconds have passed
+    # if seed is given, the case draws from a DeterministicSource,
+    # and the result includes a digest of its first passwords,
+    # which only changes if the passwords do
+    # returns a dict which can be written as JSON
+    check_option(engine,"engine",engines)
+    check_length(length)
+    function = engine_function(engine,length,valid_chars,mode,backend,sampler,seed)
+    count = 1
+    total = 0
+    elapsed = 0.0
+    while True:
+        start = time.perf_counter()
+        function(count)
+        elapsed += time.perf_counter() - start
+        total += count
+        if elapsed >= min_seconds:
+            break
+        count *= 2
+    result = {
+        "engine": engine,
+        "charset": valid_chars,
+        "charset_size": charset_size(valid_chars),
+        "length": length,
+        "mode": mode,
+        "backend": hash_backend if backend is None else backend,
+        "sampler": sampler,
+        "passwords": total,
+        "seconds": elapsed,
+        "passwords_per_second": total / elapsed,
+        "chars_per_second": total * length / elapsed
+    }
+    if seed is not None:
+        result["digest"] = hashlib.sha256("\n".join(function(BENCH_DIGEST_COUNT)).encode("UTF-8")).hexdigest()
+    return result
+
+def sweep(charsets=BENCH_CHARSETS,lengths=BENCH_LENGTHS,backends=None,modes=BENCH_MODES,samplers=BENCH_SAMPLERS,engines=BENCH_ENGINES):
+    # returns a list of cases, as dicts of bench_case parameters
+    # the first case is the baseline, made of the first entry of each list,
+    # and every other case differs from it in one parameter
+    if backends is None:
+        backends = [hash_backend] + [name for name in hash_backends if name != hash_backend]
+    baseline = {
+        "engine": engines[0],
+        "length": lengths[0],
+        "valid_chars": charsets[0],
+        "mode": modes[0],
+        "backend": backends[0],
+        "sampler": samplers[0]
+    }
+    cases = [baseline]
+    for name, values in (("valid_chars",charsets),("length",lengths),("backend",backends),("mode",modes),("sampler",samplers),("engine",engines)):
+        for value in values[1:]:
+            case = dict(baseline)
+            case[name] = value
+            cases.append(case)
+    return cases
+
+def run_benchmarks(cases=None,min_seconds=BENCH_MIN_SECONDS,progress=None,seed=None):
+    # runs each case in cases, or the sweep if cases is None
+    # progress, if given, is called with each result as it completes
+    # seed, if given, is passed to every case,
+    # and cases with the parallel engine are skipped
+    # returns a report which can be written as JSON
+    if cases is None:
+        cases = sweep()
+    if seed is not None:
+        cases = [case for case in cases if case["engine"] != "parallel"]
+    results = []
+    for case in cases:
+        result = bench_case(min_seconds=min_seconds,seed=seed,**case)
+        if progress is not None:
+            progress(result)
+        results.append(result)
+    return {
+        "python": sys.version.split()[0],
+        "implementation": platform.python_implementation(),
+        "machine": platform.machine(),
+        "system": platform.system(),
+        "SHA512_number": SHA512_number,
+        "hash_backend": hash_backend,
+        "hash_backends": list(hash_backends),
+        "min_seconds": min_seconds,
+        "seed": seed,
+        "results": results
+    }
@@ -1,6 +1,9 @@
 # Copyright Aaron Stanek 2021
 # See LICENSE for more details
 
+import functools
+from array import array
+
 # character_ranges maps character set names
 # to their definitions
 character_ranges = {
@@ -41,7 +44,33 @@ character_ranges = {
 # c is a synonym of u
 character_ranges["c"] = character_ranges["u"]
 
-def resolve_charstring(s):
+# the typecode of an array of 4 byte unsigned integers
+# used to hold the codepoints of Unicode charsets
+CODEPOINT_TYPECODE = "I" if array("I").itemsize == 4 else "L"
+
+# the codec for decoding such an array
+CODEPOINT_CODEC = "utf-32-le" if array(CODEPOINT_TYPECODE,[1]).tobytes()[0] == 1 else "utf-32-be"
+
+def check_codepoint(codepoint,unicode=False):
+    # codepoints must be ASCII printable characters
+    # if unicode is True, any printable Unicode character is allowed
+    if codepoint >= 32 and codepoint <= 126:
+        return
+    if unicode and codepoint > 126 and codepoint <= 0x10FFFF and chr(codepoint).isprintable():
+        return
+    if unicode:
+        raise ValueError("valid_chars values must correspond to printable characters")
+    raise ValueError("valid_chars values must correspond to ASCII printable characters")
+
+def codepoint_symbols(codepoints):
+    # returns sorted codepoints as a compact table
+    # bytes if they are all ASCII, otherwise an array
+    codepoints = sorted(codepoints)
+    if len(codepoints) == 0 or codepoints[-1] < 128:
+        return bytes(codepoints)
+    return array(CODEPOINT_TYPECODE,codepoints)
+
+def resolve_charstring(s,unicode=False):
     # if a string is passed as valid_chars to
     # generate_password, it will need to be
     # resolved to a set
@@ -53,6 +82,8 @@ def resolve_charstring(s):
     # i to include characters, e to exclude them
     # to include/exclude the characters i or e
     # they must be prefixed with ..
+    # if unicode is True, the i and e sections may
+    # contain any printable Unicode character
     output = set()
     mode = 0
     # mode = 0 is the header section, before i or e
@@ -66,8 +97,7 @@ def resolve_charstring(s):
             if s[index] in character_ranges:
                 # this is a named charset
                 # include all the values in its definition
-                for codepoint in character_ranges[s[index]]:
-                    output.add(codepoint)
+                output.update(character_ranges[s[index]])
             elif s[index] == "a":
                 # we have a or ar
                 # this is a shorthand
@@ -75,13 +105,11 @@ def resolve_charstring(s):
                 if index+1 < len(s):
                     if s[index+1] == "r":
                         # we have ar
-                        for codepoint in resolve_charstring("ulnrs"):
-                            output.add(codepoint)
+                        output.update(shorthand_ranges["ar"])
                         index += 2
                         continue
                 # we have a
-                for codepoint in resolve_charstring("ulnps"):
-                    output.add(codepoint)
+                output.update(shorthand_ranges["a"])
             elif s[index] == "z":
                 # we have z or zr
                 # this is a shorthand
@@ -89,13 +117,11 @@ def resolve_charstring(s):
                 if index+1 < len(s):
                     if s[index+1] == "r":
                         # we have zr
-                        for codepoint in resolve_charstring("ulnr"):
-                            output.add(codepoint)
+                        output.update(shorthand_ranges["zr"])
                         index += 2
                         continue
                 # we have z
-                for codepoint in resolve_charstring("ulnp"):
-                    output.add(codepoint)
+                output.update(shorthand_ranges["z"])
             elif s[index] == "i":
                 # we hit an i token,
                 # start an i section
@@ -144,20 +170,28 @@ def resolve_charstring(s):
                 mode = 2
             else:
                 codepoint = ord(s[index])
-                if codepoint >= 32 and codepoint <= 126:
-                    if mode == 1:
-                        # i mode
-                        output.add(codepoint)
-                    else:
-                        # e mode
-                        output.discard(codepoint)
+                check_codepoint(codepoint,unicode)
+                if mode == 1:
+                    # i mode
+                    output.add(codepoint)
                 else:
-                    raise ValueError("valid_chars values must correspond to ASCII printable characters")
+                    # e mode
+                    output.discard(codepoint)
         index += 1
     return output
 
-def resolve_charset(x):
-    # x is a set, list, or tuple
+# shorthand_ranges maps shorthands to their definitions
+# they are resolved once, rather than every time they are used
+
+shorthand_ranges = {
+    "a": frozenset(resolve_charstring("ulnps")),
+    "ar": frozenset(resolve_charstring("ulnrs")),
+    "z": frozenset(resolve_charstring("ulnp")),
+    "zr": frozenset(resolve_charstring("ulnr"))
+}
+
+def resolve_charset(x,unicode=False):
+    # x is a set, list, tuple, or range
     # containing unkown types
     # returns a set containing only int
     # scans for invalid codepoints
@@ -171,27 +205,128 @@ def resolve_charset(x):
             element = ord(element)
         else:
             raise TypeError("valid_chars collection input may only contain int and str")
-        if element >= 32 and element <= 126:
-            output.add(element)
-        else:
-            raise ValueError("valid_chars values must correspond to ASCII printable characters")
+        check_codepoint(element,unicode)
+        output.add(element)
     return output
 
-def normalize_valid_chars(x):
+def normalize_valid_chars(x,unicode=False):
     # x is any type
     # if we can convert x to a valid_chars set
     # then we will, otherwise throw an exception
     if type(x) == str:
-        return resolve_charstring(x)
-    elif type(x) in [set,list,tuple]:
-        return resolve_charset(x)
+        return resolve_charstring(x,unicode)
+    elif type(x) in [set,frozenset,list,tuple,range]:
+        return resolve_charset(x,unicode)
+    elif type(x) == Charset:
+        return set(x.codepoints)
     else:
-        raise TypeError("valid_chars parameter must be of type str, set, list, or tuple")
+        raise TypeError("valid_chars parameter must be of type str, set, list, tuple, range, or Charset")
 
 def charset_size(x):
     # normalizes charset x
     # then returns its size
-    return len(normalize_valid_chars(x))
+    return len(compile_charset(x))
+
+class Charset(object):
+    # an immutable, resolved valid_chars
+    # if unicode is True, the charset may hold any printable
+    # Unicode characters, not only ASCII printable characters
+    # mask has bit n set if codepoint n is in the set
+    # codepoints holds the sorted codepoints, as bytes for ASCII charsets,
+    # and as an array of 4 byte integers otherwise
+    # symbols holds the same characters as a str
+    # for ASCII charsets, table maps each byte to its character, or to 0
+    # if the byte is rejected, in the same way as create_character_map
+    # rejected holds the rejected bytes
+    # table and rejected can be passed to bytes.translate
+    # other charsets have no table, and are sampled with an IndexSampler
+    __slots__ = ("mask","codepoints","symbols","ascii","table","rejected")
+    def __init__(self,x,unicode=False):
+        valid_chars = normalize_valid_chars(x,unicode)
+        codepoints = codepoint_symbols(valid_chars)
+        # the mask is built as a bitmap, since shifting a large int
+        # once per codepoint is quadratic in the size of a Unicode charset
+        bitmap = bytearray((max(valid_chars) >> 3) + 1 if len(valid_chars) > 0 else 0)
+        for codepoint in valid_chars:
+            bitmap[codepoint >> 3] |= 1 << (codepoint & 7)
+        ascii = type(codepoints) == bytes
+        object.__setattr__(self,"mask",int.from_bytes(bitmap,"little"))
+        object.__setattr__(self,"codepoints",codepoints)
+        object.__setattr__(self,"symbols",codepoints.decode("UTF-8") if ascii else codepoints.tobytes().decode(CODEPOINT_CODEC))
+        object.__setattr__(self,"ascii",ascii)
+        if not ascii:
+            object.__setattr__(self,"table",None)
+            object.__setattr__(self,"rejected",None)
+            return
+        table = bytearray(256)
+        if len(codepoints) > 0:
+            repetitions = 256 // len(codepoints)
+            for index in range(len(codepoints)):
+                table[index*repetitions:(index+1)*repetitions] = bytes([codepoints[index]]) * repetitions
+        object.__setattr__(self,"table",bytes(table))
+        object.__setattr__(self,"rejected",bytes(index for index in range(256) if table[index] == 0))
+    def __setattr__(self,name,value):
+        raise AttributeError("Charset objects are immutable")
+    def __reduce__(self):
+        # allows Charset objects to be pickled,
+        # and sent to other processes
+        return (Charset,(tuple(self.codepoints),not self.ascii))
+    def __len__(self):
+        return len(self.codepoints)
+    def __iter__(self):
+        return iter(self.codepoints)
+    def __contains__(self,codepoint):
+        if type(codepoint) == str:
+            if len(codepoint) != 1:
+                return False
+            codepoint = ord(codepoint)
+        return type(codepoint) == int and codepoint >= 0 and (self.mask >> codepoint) & 1 == 1
+    def __eq__(self,other):
+        return type(other) == Charset and self.mask == other.mask
+    def __hash__(self):
+        return hash(self.mask)
+    def __repr__(self):
+        if self.ascii:
+            return "Charset(" + repr(self.symbols) + ")"
+        return "Charset(" + repr(self.symbols) + ",unicode=True)"
+
+# the number of charstrings and collections
+# whose Charset is remembered
+CHARSET_CACHE_SIZE = 256
+
+@functools.lru_cache(maxsize=CHARSET_CACHE_SIZE)
+def cached_charset(x):
+    # x is a str, or a frozenset of (type, element) pairs
+    if type(x) == str:
+        return Charset(x)
+    return Charset([element for kind, element in x])
+
+def compile_charset(x):
+    # returns the Charset for valid_chars x
+    # charstrings and collections of hashable elements
+    # are looked up in the cache first
+    if type(x) == Charset:
+        return x
+    if type(x) == str:
+        return cached_charset(x)
+    if type(x) in [set,frozenset,list,tuple,range]:
+        # elements are tagged with their type, since 33, 33.0,
+        # and True may be equal, but only 33 is valid
+        try:
+            key = frozenset((type(element),element) for element in x)
+        except TypeError:
+            # unhashable elements, which resolve_charset will reject
+            return Charset(x)
+        return cached_charset(key)
+    raise TypeError("valid_chars parameter must be of type str, set, list, tuple, range, or Charset")
+
+def charset_cache_info():
+    # returns the hits, misses, maxsize, and currsize
+    # of the Charset cache
+    return cached_charset.cache_info()
+
+def charset_cache_clear():
+    cached_charset.cache_clear()
 
 def create_character_map(valid_chars):
     # valid_chars is set(int)
@@ -214,3 +349,143 @@ def create_character_map(valid_chars):
     # to 256
     output += [None] * (256-len(output))
     return output
+
+# NumPy is optional
+# if it is installed, large blocks of random bytes are sampled
+# with vectorized operations instead of a Python loop
+# it is imported the first time it could be used,
+# so that it never slows down startup
+# set use_numpy to False to always use the Python loop
+use_numpy = True
+numpy_module = None
+numpy_checked = False
+
+# blocks of random bytes smaller than this are
+# faster to sample in Python than to hand to NumPy
+NUMPY_MIN_BYTES = 1024
+
+# the big-endian NumPy dtype for each IndexSampler width
+NUMPY_DTYPES = {1: ">u1", 2: ">u2", 4: ">u4", 8: ">u8"}
+
+def get_numpy():
+    # returns the numpy module, or None if it is not installed
+    global numpy_module, numpy_checked
+    if not numpy_checked:
+        try:
+            import numpy
+            numpy_module = numpy
+        except ImportError:
+            numpy_module = None
+        numpy_checked = True
+    return numpy_module
+
+class IndexSampler(object):
+    # an alternative to create_character_map
+    # which wastes far fewer random bytes
+    # each block of width random bytes is read as a big-endian integer x
+    # if x is below limit, then x is uniformly distributed over
+    # limit = modulus * k, and x % modulus holds digits independent,
+    # uniformly distributed, base-size digits
+    # each digit selects one character from valid_chars
+    # if x is not below limit, the whole block is rejected
+    # modulus is chosen so that fewer than 1 in 128 blocks are rejected
+    def __init__(self,valid_chars,width):
+        # valid_chars is a nonempty set(int) or Charset
+        # width is the number of bytes in each block
+        # symbols is bytes for ASCII charsets, and an array otherwise
+        # characters are appended to a bytearray or an array to match
+        # a range is kept as it is, so that range(n) samples indices
+        # below n into an array, without building a table of them
+        if type(valid_chars) == range:
+            self.symbols = valid_chars
+        else:
+            self.symbols = codepoint_symbols(valid_chars)
+        self.size = len(self.symbols)
+        self.width = width
+        span = 256 ** width
+        if self.size == 1:
+            # there is nothing to choose
+            self.digits = width
+            self.modulus = 1
+        else:
+            self.digits = 0
+            self.modulus = 1
+            while True:
+                modulus = self.modulus * self.size
+                if modulus > span:
+                    break
+                if modulus * 128 > span and span % modulus != 0:
+                    # more than 1 in 128 blocks would be rejected
+                    break
+                self.digits += 1
+                self.modulus = modulus
+            if self.digits < 1:
+                raise ValueError("width parameter is too small for valid_chars")
+        self.limit = self.modulus * (span // self.modulus)
+        # the probability that a block is rejected
+        self.rejection_rate = (span - self.limit) / span
+    def sample(self,data,output,length):
+        # data is a bytes-like object holding random bytes
+        # appends characters from valid_chars to output (a bytearray)
+        # until data runs out, or output has the given length
+        if use_numpy and len(data) >= NUMPY_MIN_BYTES and self.width in NUMPY_DTYPES:
+            np = get_numpy()
+            if np is not None:
+                return self.sample_numpy(np,data,output,length)
+        width = self.width
+        size = self.size
+        symbols = self.symbols
+        for offset in range(0,len(data)-width+1,width):
+            x = int.from_bytes(data[offset:offset+width],"big")
+            if x >= self.limit:
+                continue
+            for i in range(self.digits):
+                x, digit = divmod(x,size)
+                output.append(symbols[digit])
+                if len(output) >= length:
+                    return
+    def sample_numpy(self,np,data,output,length):
+        # the same as sample, but vectorized
+        # appends exactly the same characters as sample would
+        if len(output) >= length:
+            return
+        size = np.uint64(self.size)
+        blocks = np.frombuffer(data,dtype=NUMPY_DTYPES[self.width],count=len(data)//self.width).astype(np.uint64)
+        if self.limit < 2**64:
+            # the rejection mask
+            blocks = blocks[blocks < np.uint64(self.limit)]
+        # each block gives digits characters,
+        # so only the first few blocks may be needed
+        needed = length - len(output)
+        blocks = blocks[:-(-needed // self.digits)]
+        indices = np.empty((len(blocks),self.digits),dtype=np.uint64)
+        for i in range(self.digits):
+            indices[:,i] = blocks % size
+            blocks = blocks // size
+        if type(self.symbols) == bytes:
+            symbols = np.frombuffer(self.symbols,dtype=np.uint8)
+            output.extend(np.take(symbols,indices.ravel()[:needed]).tobytes())
+        elif type(self.symbols) == range:
+            symbols = self.symbols
+            output.frombytes((indices.ravel()[:needed] * np.uint64(symbols.step) + np.uint64(symbols.start)).astype(np.uint32).tobytes())
+        else:
+            symbols = np.frombuffer(self.symbols,dtype=np.uint32)
+            output.frombytes(np.take(symbols,indices.ravel()[:needed]).tobytes())
+
+def rejection_rate(x,width=1):
+    # the probability that a random value is rejected,
+    # rather than becoming a character in charset x
+    # width 1 is the single byte character map,
+    # larger widths are the IndexSampler with blocks of that many bytes
+    valid_chars = compile_charset(x)
+    if len(valid_chars) < 1:
+        raise ValueError("valid_chars parameter has minimum size 1")
+    if type(width) != int:
+        raise TypeError("width parameter must be int")
+    if width < 1:
+        raise ValueError("width parameter has minimum 1")
+    if width == 1:
+        if not valid_chars.ascii:
+            raise ValueError("width 1 is only supported for ASCII charsets")
+        return len(valid_chars.rejected) / 256
+    return IndexSampler(valid_chars,width).rejection_rate
@@ -0,0 +1,119 @@
+# Copyright Aaron Stanek 2021
+# See LICENSE for more details
+
+import os
+import socket
+import stat
+import struct
+
+# the client only imports os, socket, stat, and struct,
+# so that asking a running server for a password is faster
+# than generating it in a new process
+
+# the size of each read from the server
+CLIENT_BUFFER_SIZE = 65536
+
+def check_private_directory(path):
+    # the directory must belong to this user, and be closed to everyone else
+    # otherwise another user could put their own socket in it
+    info = os.lstat(path)
+    if not stat.S_ISDIR(info.st_mode) or info.st_uid != os.getuid() or info.st_mode & 0o077:
+        raise ValueError(path+" must be a directory owned by this user, which no one else may use")
+
+def default_socket_path(create=False):
+    # $PASSUTIL_SOCKET, then passutil.sock in $XDG_RUNTIME_DIR,
+    # then passutil.sock in a private passutil-<uid> directory in $TMPDIR or /tmp
+    # the private directory is made if create is True
+    path = os.environ.get("PASSUTIL_SOCKET")
+    if path:
+        return path
+    runtime = os.environ.get("XDG_RUNTIME_DIR")
+    if runtime:
+        return os.path.join(runtime,"passutil.sock")
+    directory = os.path.join(os.environ.get("TMPDIR","/tmp"),"passutil-"+str(os.getuid()))
+    if create:
+        try:
+            os.mkdir(directory,0o700)
+        except FileExistsError:
+            pass
+    if create or os.path.lexists(directory):
+        check_private_directory(directory)
+    return os.path.join(directory,"passutil.sock")
+
+def check_unix_sockets():
+    if not hasattr(socket,"AF_UNIX"):
+        raise ValueError("Unix domain sockets are not supported on this system")
+
+# struct ucred, returned by SO_PEERCRED: pid, uid, gid
+peer_credentials = struct.Struct("3i")
+
+def check_server(connection,path):
+    # the server must be run by this user
+    # otherwise it could hand out passwords of its own choosing
+    try:
+        info = os.stat(path)
+    except OSError:
+        info = None
+    if info is None or not stat.S_ISSOCK(info.st_mode) or info.st_uid != os.getuid():
+        raise ValueError(path+" is not a socket owned by this user")
+    if hasattr(socket,"SO_PEERCRED"):
+        pid, uid, gid = peer_credentials.unpack(connection.getsockopt(socket.SOL_SOCKET,socket.SO_PEERCRED,peer_credentials.size))
+        if uid != os.getuid():
+            raise ValueError("the server on "+path+" is not run by this user")
+
+def format_request(valid_chars,length,count=1,key=""):
+    # a request is a single line of UTF-8:
+    # <valid_chars> <length> <count> <key, optional>
+    if type(valid_chars) != str:
+        raise TypeError("valid_chars parameter must be str when sent to a server")
+    if type(key) != str:
+        raise TypeError("key parameter must be str when sent to a server")
+    if len(valid_chars.split()) != 1:
+        raise ValueError("valid_chars parameter may not be empty or contain whitespace when sent to a server")
+    if "\n" in key or "\r" in key:
+        raise ValueError("key parameter may not contain a line break when sent to a server")
+    line = valid_chars + " " + str(length) + " " + str(count)
+    if len(key) > 0:
+        line += " " + key
+    return (line + "\n").encode("UTF-8")
+
+def request_raw(request,path=None):
+    # sends a request from format_request to the server at path
+    # returns the passwords as UTF-8 bytes, each followed by a newline
+    # raises ValueError with the message from the server if it refuses
+    check_unix_sockets()
+    if path is None:
+        path = default_socket_path()
+    chunks = []
+    with socket.socket(socket.AF_UNIX,socket.SOCK_STREAM) as connection:
+        try:
+            connection.connect(path)
+        except OSError:
+            raise ValueError("no server is listening on "+path+", start one with: python -m passutil --serve")
+        check_server(connection,path)
+        connection.sendall(request)
+        # no more requests, so the server closes
+        # the connection once it has answered
+        connection.shutdown(socket.SHUT_WR)
+        while True:
+            chunk = connection.recv(CLIENT_BUFFER_SIZE)
+            if len(chunk) == 0:
+                break
+            chunks.append(chunk)
+    header, newline, body = b''.join(chunks).partition(b'\n')
+    if header.startswith(b'ERR '):
+        raise ValueError(header[4:].decode("UTF-8"))
+    if not header.startswith(b'OK ') or body.count(b'\n') != int(header[3:]):
+        raise ValueError("incomplete response from the server")
+    return body
+
+def request_passwords(count,length,valid_chars,key="",path=None):
+    # asks the server at path for count passwords of the given length
+    # returns them as a list of str
+    # key is mixed into the state of the server's generator
+    body = request_raw(format_request(valid_chars,length,count,key),path)
+    return body.decode("UTF-8").split("\n")[:-1]
+
+def request_password(length,valid_chars,key="",path=None):
+    # asks the server at path for a single password
+    return request_passwords(1,length,valid_chars,key,path)[0]
@@ -0,0 +1,128 @@
+# Copyright Aaron Stanek 2021
+# See LICENSE for more details
+
+import abc
+import os
+import struct
+import time
+
+# secrets.token_bytes is os.urandom,
+# but importing secrets takes longer than the rest of passutil
+token_bytes = os.urandom
+
+# the size of the first chunk drawn by an EntropyPool
+# each refill doubles the chunk size, up to POOL_MAX_CHUNK
+# so short passwords don't pay for a large draw,
+# and long passwords only make a few large ones
+POOL_MIN_CHUNK = 4096
+POOL_MAX_CHUNK = 65536
+
+if hasattr(os,"register_at_fork"):
+    # counts the forks since passutil was imported
+    # a child process sees a different count than its parent
+    # and is much cheaper to check than os.getpid
+    forks = 0
+    def count_fork():
+        global forks
+        forks += 1
+    os.register_at_fork(after_in_child=count_fork)
+    def fork_generation():
+        return forks
+else:
+    # Python 3.6 can't be told about forks,
+    # so the process id is checked instead
+    fork_generation = os.getpid
+
+class EntropyPool(object):
+    # hands out random bytes from a buffer
+    # which is filled by the OS in large chunks
+    # reseed schedule:
+    # every byte in a chunk is handed out at most once
+    # when a request can't be satisfied by the rest of the chunk,
+    # the rest is discarded and a new chunk is drawn from source
+    # a forked child has a copy of the chunk, which its parent
+    # would hand out too, so the child throws its copy away
+    # before taking anything
+    # the generator also takes its time stamps from source
+    def __init__(self,max_chunk=POOL_MAX_CHUNK,source=None):
+        self.source = resolve_source(source)
+        self.max_chunk = max_chunk
+        self.chunk_size = min(POOL_MIN_CHUNK,max_chunk)
+        self.view = memoryview(b'')
+        self.position = 0
+        self.refills = 0
+        self.generation = fork_generation()
+    def check_fork(self):
+        # returns True if the process has forked since the pool
+        # was made or last checked, after discarding the chunk
+        generation = fork_generation()
+        if generation == self.generation:
+            return False
+        self.generation = generation
+        self.view = memoryview(b'')
+        self.position = 0
+        return True
+    def refill(self,minimum=0):
+        # draws a new chunk, of at least minimum bytes
+        size = max(self.chunk_size,minimum)
+        self.view = memoryview(self.source.random_bytes(size))
+        self.position = 0
+        self.refills += 1
+        self.chunk_size = min(self.chunk_size*2,self.max_chunk)
+    def take(self,n):
+        # returns a memoryview of n fresh random bytes
+        # the view points into the chunk, nothing is copied
+        if self.generation != fork_generation():
+            self.check_fork()
+        end = self.position + n
+        if end > len(self.view):
+            self.refill(n)
+            end = n
+        output = self.view[self.position:end]
+        self.position = end
+        return output
+
+# pack two unsigned 64 bit integers, big-endian
+pack_time = struct.Struct(">QQ").pack
+
+if hasattr(time,"time_ns"):
+    def time_stamp():
+        # 16 bytes from the wall clock and
+        # the performance counter, in nanoseconds
+        # much cheaper than formatting and hashing the time
+        return pack_time(time.time_ns(),time.perf_counter_ns() & 0xFFFFFFFFFFFFFFFF)
+else:
+    # Python 3.6 has no nanosecond clocks
+    def time_stamp():
+        return pack_time(int(time.time()*1e9),int(time.perf_counter()*1e9) & 0xFFFFFFFFFFFFFFFF)
+
+class EntropySource(abc.ABC):
+    # where a generator gets its random bytes and its time stamps
+    # random_bytes(n) returns n bytes
+    # time_stamp() returns 16 bytes which change from call to call
+    # the generator's security rests on random_bytes,
+    # so anything other than SystemSource is only for testing
+    # a subclass which is missing either method can't be created,
+    # rather than failing in the middle of a password
+    @abc.abstractmethod
+    def random_bytes(self,n):
+        raise NotImplementedError
+    @abc.abstractmethod
+    def time_stamp(self):
+        raise NotImplementedError
+
+class SystemSource(EntropySource):
+    # the OS random number generator, and the system clocks
+    # the default source of every generator
+    random_bytes = staticmethod(token_bytes)
+    time_stamp = staticmethod(time_stamp)
+
+system_source = SystemSource()
+
+def resolve_source(source):
+    # returns source, or the SystemSource if it is None
+    if source is None:
+        return system_source
+    if not isinstance(source,EntropySource):
+        raise TypeError("source parameter must be an EntropySource or None")
+    return source
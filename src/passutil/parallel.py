@@ -0,0 +1,82 @@
+# Copyright Aaron Stanek 2021
+# See LICENSE for more details
+
+import os
+import pickle
+from concurrent.futures import ProcessPoolExecutor
+from .pu import PasswordGenerator, UniqueCounter, check_length, check_mode, check_option, samplers, resolve_backend, normalize_key, prepare_charset
+
+# the largest number of passwords
+# generated by a worker in a single task
+PARALLEL_MAX_CHUNK = 10000
+
+def generate_chunk(task):
+    # runs in a worker process
+    # generates count passwords of the given length
+    # and returns them joined together as one ascii encoded bytes object,
+    # which is much cheaper to send back than a list of str
+    count, length, key, charset, mode, backend, sampler, domain = task
+    # the generator draws its own counter and entropy from the OS,
+    # so every worker starts from independent fresh entropy
+    generator = PasswordGenerator(key,charset,mode,backend,sampler)
+    # domain is unique to this task
+    generator.separate(domain)
+    return "".join(generator.next_passwords(count,length)).encode("UTF-8")
+
+def create_tasks(count,length,key,charset,mode,backend,sampler,chunk_size):
+    # splits count passwords into tasks of at most chunk_size passwords
+    # each task gets a domain separator from a UniqueCounter,
+    # so no two tasks can share a hash input
+    counter = UniqueCounter()
+    tasks = []
+    while count > 0:
+        n = min(chunk_size,count)
+        tasks.append((n,length,key,charset,mode,backend,sampler,counter()))
+        count -= n
+    return tasks
+
+def iter_passwords_parallel(count,length,key,valid_chars,workers=None,chunk_size=None,mode="standard",backend=None,sampler="byte"):
+    # generates count passwords of the given length,
+    # spread across a pool of worker processes
+    # yields lists of passwords, in the order the tasks were created,
+    # as each task completes
+    check_length(count,"count")
+    check_length(length)
+    check_mode(mode)
+    check_option(sampler,"sampler",samplers)
+    # the backend itself is sent to the workers, so that ones
+    # which aren't in hash_backends work there too
+    backend = resolve_backend(backend)
+    try:
+        pickle.dumps(backend)
+    except (pickle.PicklingError,AttributeError,TypeError):
+        raise TypeError("backend parameter must be picklable to be sent to worker processes")
+    key = normalize_key(key)
+    charset = prepare_charset(valid_chars)
+    if workers is None:
+        workers = os.cpu_count() or 1
+    check_length(workers,"workers")
+    if workers < 1:
+        raise ValueError("workers parameter has minimum 1")
+    if chunk_size is None:
+        # a few tasks per worker, so that the work stays balanced
+        chunk_size = min(PARALLEL_MAX_CHUNK,max(1,count // (workers*4)))
+    check_length(chunk_size,"chunk_size")
+    if chunk_size < 1:
+        raise ValueError("chunk_size parameter has minimum 1")
+    tasks = create_tasks(count,length,key,charset,mode,backend,sampler,chunk_size)
+    if len(tasks) == 0:
+        return
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        for task, chunk in zip(tasks,executor.map(generate_chunk,tasks)):
+            # split the chunk back into task[0] passwords
+            chunk = chunk.decode("UTF-8")
+            yield [chunk[index*length:(index+1)*length] for index in range(task[0])]
+
+def generate_passwords_parallel(count,length,key,valid_chars,workers=None,chunk_size=None,mode="standard",backend=None,sampler="byte"):
+    # the same as generate_passwords, but spread across
+    # a pool of worker processes
+    passwords = []
+    for chunk in iter_passwords_parallel(count,length,key,valid_chars,workers,chunk_size,mode,backend,sampler):
+        passwords.extend(chunk)
+    return passwords
@@ -0,0 +1,239 @@
+# Copyright Aaron Stanek 2021
+# See LICENSE for more details
+
+import functools
+import itertools
+import math
+from array import array
+from .chars import character_ranges, compile_charset, CODEPOINT_TYPECODE, CODEPOINT_CODEC
+
+# characters which are easily mistaken for one another
+AMBIGUOUS_CHARS = "0O1Il|`'\""
+
+# the longest password which may be generated under a policy
+# the counting tables grow with the length, and building them
+# is the slowest part of the first password for each policy
+POLICY_MAX_LENGTH = 256
+
+class Policy(object):
+    # an immutable password policy
+    # minimums maps names from chars.character_ranges to the
+    # least number of characters from that set in every password
+    # max_run is the most times a character may appear in a row, or None
+    # exclude is a str of characters which may never appear,
+    # and exclude_ambiguous adds AMBIGUOUS_CHARS to it
+    __slots__ = ("minimums","max_run","exclude")
+    def __init__(self,minimums=None,max_run=None,exclude="",exclude_ambiguous=False):
+        if minimums is None:
+            minimums = {}
+        if type(minimums) != dict:
+            raise TypeError("minimums parameter must be dict or None")
+        for name, minimum in minimums.items():
+            if name not in character_ranges:
+                raise ValueError("minimums keys must be one of: "+", ".join(sorted(character_ranges)))
+            if type(minimum) != int:
+                raise TypeError("minimums values must be int")
+            if minimum < 0:
+                raise ValueError("minimums values must be nonnegative")
+        if max_run is not None:
+            if type(max_run) != int:
+                raise TypeError("max_run parameter must be int or None")
+            if max_run < 1:
+                raise ValueError("max_run parameter has minimum 1")
+        if type(exclude) != str:
+            raise TypeError("exclude parameter must be str")
+        if exclude_ambiguous:
+            exclude += AMBIGUOUS_CHARS
+        object.__setattr__(self,"minimums",tuple(sorted((name,minimum) for name, minimum in minimums.items() if minimum > 0)))
+        object.__setattr__(self,"max_run",max_run)
+        object.__setattr__(self,"exclude",frozenset(map(ord,exclude)))
+    def __setattr__(self,name,value):
+        raise AttributeError("Policy objects are immutable")
+    def __reduce__(self):
+        return (Policy,(dict(self.minimums),self.max_run,"".join(map(chr,sorted(self.exclude)))))
+    def __eq__(self,other):
+        return type(other) == Policy and (self.minimums,self.max_run,self.exclude) == (other.minimums,other.max_run,other.exclude)
+    def __hash__(self):
+        return hash((self.minimums,self.max_run,self.exclude))
+    def __repr__(self):
+        return "Policy(minimums=" + repr(dict(self.minimums)) + ",max_run=" + repr(self.max_run) + ",exclude=" + repr("".join(map(chr,sorted(self.exclude)))) + ")"
+    def count(self,length,valid_chars):
+        # the number of passwords of the given length from valid_chars
+        # which satisfy the policy
+        return compile_policy(self,compile_charset(valid_chars)).count(length)
+    def cost(self,length,valid_chars,mode="standard"):
+        # returns a dict describing the expected cost of generating
+        # a password of the given length from valid_chars under this policy
+        # in the given mode, compared with generating passwords until one complies
+        return compile_policy(self,compile_charset(valid_chars)).cost(length,mode)
+
+class PolicySampler(object):
+    # samples passwords uniformly from the passwords which satisfy a policy
+    # the alphabet is split into atoms: characters which belong to
+    # exactly the same sets of the policy are interchangeable
+    # the number of compliant passwords is counted with a table over states
+    # (the sets still needed, the atom of the last character, the length of its run)
+    # then a single uniform integer below that number is drawn,
+    # and turned into the password it indexes
+    # every compliant password has exactly one index, so every
+    # compliant password is equally likely, and none is ever thrown away
+    def __init__(self,policy,charset):
+        self.policy = policy
+        alphabet = sorted(set(charset) - policy.exclude)
+        if len(alphabet) < 1:
+            raise ValueError("valid_chars parameter has no characters which the policy allows")
+        classes = [frozenset(character_ranges[name]) for name, minimum in policy.minimums]
+        self.needs = tuple(minimum for name, minimum in policy.minimums)
+        groups = {}
+        for codepoint in alphabet:
+            signature = tuple(int(codepoint in members) for members in classes)
+            groups.setdefault(signature,[]).append(codepoint)
+        self.signatures = sorted(groups)
+        self.atoms = [groups[signature] for signature in self.signatures]
+        self.size = len(alphabet)
+        self.max_run = policy.max_run
+        # levels[n][i] is the number of ways to complete
+        # states[i] with n more characters
+        self.levels = []
+        self.states = list(self.enumerate_states())
+        self.index = {state: i for i, state in enumerate(self.states)}
+        # edges[i] lists (choices, index of the next state) for states[i],
+        # so that building a level does no tuple or dict work
+        self.edges = [[(choices,self.index[following]) for atom, choices, following, repeat in self.transitions(state)] for state in self.states]
+    def enumerate_states(self):
+        if self.max_run is None:
+            lasts = [(-1,0)]
+        else:
+            lasts = [(-1,0)] + [(atom,run) for atom in range(len(self.atoms)) for run in range(1,self.max_run+1)]
+        for needs in itertools.product(*[range(need+1) for need in self.needs]):
+            for last, run in lasts:
+                yield (needs,last,run)
+    def transitions(self,state):
+        # yields (atom, choices, next state, repeat) for each way of
+        # choosing the next character
+        # repeat is True if the next character is the same as the last one
+        needs, last, run = state
+        for atom in range(len(self.atoms)):
+            signature = self.signatures[atom]
+            following = tuple(max(0,need-member) for need, member in zip(needs,signature))
+            size = len(self.atoms[atom])
+            if self.max_run is None:
+                yield (atom,size,(following,-1,0),False)
+            elif atom == last:
+                if size > 1:
+                    yield (atom,size-1,(following,atom,1),False)
+                if run < self.max_run:
+                    yield (atom,1,(following,atom,run+1),True)
+            else:
+                yield (atom,size,(following,atom,1),False)
+    def extend_levels(self,length):
+        if length > POLICY_MAX_LENGTH:
+            raise ValueError("length parameter has maximum "+str(POLICY_MAX_LENGTH)+" when a policy is given")
+        if len(self.levels) == 0:
+            self.levels.append([int(max(state[0],default=0) == 0) for state in self.states])
+        while len(self.levels) <= length:
+            previous = self.levels[-1]
+            self.levels.append([sum(choices*previous[following] for choices, following in edges) for edges in self.edges])
+    def initial_state(self):
+        return (self.needs,-1,0)
+    def count(self,length):
+        self.extend_levels(length)
+        return self.levels[length][self.index[self.initial_state()]]
+    def table_operations(self,length):
+        # the multiplications needed to build the counting table up to length,
+        # whether or not they have been done already
+        return length * sum(map(len,self.edges))
+    def cost(self,length,mode="standard"):
+        if mode not in hash_calls:
+            raise ValueError("mode parameter must be one of: "+", ".join(hash_calls))
+        compliant = self.count(length)
+        total = self.size ** length
+        words = random_words(compliant) if compliant > 0 else 0
+        return {
+            "compliant": compliant,
+            "total": total,
+            "acceptance_rate": compliant / total if total > 0 else 0.0,
+            "entropy_bits": math.log2(compliant) if compliant > 0 else 0.0,
+            "unconstrained_entropy_bits": length * math.log2(self.size),
+            # the expected number of passwords that a generate and retry loop
+            # would have to make to get one which complies
+            "retry_attempts": total / compliant if compliant > 0 else math.inf,
+            # the random bytes this sampler draws from the hash chain for a password
+            "random_bytes": 4 * words,
+            # the hash function calls this sampler makes for a password
+            "hash_calls": hash_calls[mode](words) if compliant > 0 else 0,
+            # the size of the counting table, which is built once
+            # for each policy and charset, before the first password
+            "table_states": len(self.states),
+            "table_operations": self.table_operations(length)
+        }
+    def unrank(self,index,length):
+        # returns the codepoints of the compliant password with the given index
+        self.extend_levels(length)
+        state = self.initial_state()
+        output = array(CODEPOINT_TYPECODE)
+        for remaining in range(length,0,-1):
+            level = self.levels[remaining-1]
+            for atom, choices, following, repeat in self.transitions(state):
+                completions = level[self.index[following]]
+                if index < choices * completions:
+                    choice, index = divmod(index,completions)
+                    if repeat:
+                        codepoint = output[-1]
+                    elif atom == state[1]:
+                        # any character of the atom except the last one
+                        symbols = self.atoms[atom]
+                        if choice >= symbols.index(output[-1]):
+                            choice += 1
+                        codepoint = symbols[choice]
+                    else:
+                        codepoint = self.atoms[atom][choice]
+                    break
+                index -= choices * completions
+            output.append(codepoint)
+            state = following
+        return output
+    def sample(self,generator,length):
+        # returns a compliant password of the given length, as a str
+        compliant = self.count(length)
+        if compliant == 0:
+            raise ValueError("no password of this length satisfies the policy")
+        return self.unrank(draw_below(generator,compliant),length).tobytes().decode(CODEPOINT_CODEC)
+
+@functools.lru_cache(maxsize=64)
+def compile_policy(policy,charset):
+    # the counting tables are shared by every password
+    # generated with the same policy and charset
+    if type(policy) != Policy:
+        raise TypeError("policy parameter must be a Policy or None")
+    return PolicySampler(policy,charset)
+
+def random_words(n):
+    # the number of 32 bit words drawn for an integer below n
+    # 64 extra bits keep the chance of drawing again below 2**-64
+    return (n.bit_length() + 64 + 31) // 32
+
+# the hash function calls made to draw the given number of 32 bit words,
+# for each mode of PasswordGenerator
+# every draw starts with one 'password:' step, then standard mode hashes
+# twice for every word, high_yield mode hashes twice for every 16 words,
+# and the other modes hash twice
+hash_calls = {
+    "standard": lambda words: 1 + 2 * words,
+    "high_yield": lambda words: 1 + 2 * -(-words // 16),
+    "shake": lambda words: 3,
+    "batched": lambda words: 3
+}
+
+def draw_below(generator,n):
+    # returns an integer uniformly distributed below n,
+    # built from 32 bit words drawn from the hash chain of generator
+    words = random_words(n)
+    span = 1 << (32 * words)
+    limit = span - span % n
+    while True:
+        value = 0
+        for word in generator.next_indices(words,1 << 32):
+            value = (value << 32) | word
+        if value < limit:
+            return value % n
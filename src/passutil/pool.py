@@ -0,0 +1,228 @@
+# Copyright Aaron Stanek 2021
+# See LICENSE for more details
+
+import collections
+import threading
+import time
+from .pu import check_length, normalize_key, prepare_charset
+from .threadsafe import ThreadSafeGenerator
+from .entropy import fork_generation
+
+# taken by the first thread of a forked child to use a pool,
+# while the others wait for it to reset the pool
+fork_lock = threading.Lock()
+
+class PoolBucket(object):
+    # the ready passwords for a single (length, charset) pair
+    # each password is kept as a bytearray, so that
+    # it can be wiped once it has been handed out
+    # refilling is True while a thread is generating passwords for the bucket
+    __slots__ = ("length","charset","generator","entries","refilling")
+    def __init__(self,length,charset,generator):
+        self.length = length
+        self.charset = charset
+        self.generator = generator
+        self.entries = collections.deque()
+        self.refilling = False
+
+def wipe(entry):
+    # overwrites a bytearray with zeros
+    entry[:] = bytes(len(entry))
+
+class PasswordPool(object):
+    # keeps passwords ready, so that they can be handed out
+    # without waiting for the hash chain
+    # there is one bucket of passwords for each (length, valid_chars) pair
+    # a background thread refills a bucket to size passwords
+    # when it falls below low_watermark
+    # key, mode, backend, and sampler are the same as in ThreadSafeGenerator
+    def __init__(self,key,size=1000,low_watermark=None,mode="shake",backend=None,sampler="byte"):
+        check_length(size,"size")
+        if size < 1:
+            raise ValueError("size parameter has minimum 1")
+        if low_watermark is None:
+            low_watermark = size // 2
+        check_length(low_watermark,"low_watermark")
+        if low_watermark > size:
+            raise ValueError("low_watermark parameter may not be greater than size")
+        self.key = normalize_key(key)
+        self.size = size
+        self.low_watermark = low_watermark
+        self.mode = mode
+        self.backend = backend
+        self.sampler = sampler
+        self.buckets = {}
+        # buckets waiting to be refilled, in order
+        self.pending = collections.OrderedDict()
+        self.closed = False
+        # metrics
+        self.hits = 0
+        self.misses = 0
+        self.refills = 0
+        self.refill_seconds = 0.0
+        self.last_refill_seconds = 0.0
+        self.generation = fork_generation()
+        self.start()
+    def start(self):
+        # makes the lock and starts the background thread
+        # a forked child does this again, since threads don't survive a fork,
+        # and the parent may have been holding the lock when it forked
+        self.lock = threading.Lock()
+        self.wakeup = threading.Condition(self.lock)
+        # notified when a refill finishes
+        self.refilled = threading.Condition(self.lock)
+        if not self.closed:
+            self.thread = threading.Thread(target=self.refill_loop,name="passutil-pool",daemon=True)
+            self.thread.start()
+    def check_fork(self):
+        # a forked child has a copy of every password in the pool,
+        # which its parent will hand out too
+        # so the child wipes its copies, drops the buckets
+        # and their generators, and starts its own background thread
+        if self.generation == fork_generation():
+            return
+        with fork_lock:
+            if self.generation == fork_generation():
+                return
+            for bucket in self.buckets.values():
+                while len(bucket.entries) > 0:
+                    wipe(bucket.entries.popleft())
+            self.buckets = {}
+            self.pending = collections.OrderedDict()
+            self.start()
+            self.generation = fork_generation()
+    def __enter__(self):
+        return self
+    def __exit__(self,exc_type,exc_value,traceback):
+        self.close()
+    def bucket(self,length,valid_chars):
+        # returns the bucket for (length, valid_chars), creating it if needed
+        # must be called without holding lock, since setting up
+        # a generator hashes the key and would stall every other bucket
+        check_length(length)
+        charset = prepare_charset(valid_chars)
+        self.check_fork()
+        with self.lock:
+            bucket = self.buckets.get((length,charset))
+        if bucket is None:
+            generator = ThreadSafeGenerator(self.key,charset,self.mode,self.backend,self.sampler)
+            with self.lock:
+                # another thread may have made the bucket in the meantime
+                bucket = self.buckets.setdefault((length,charset),PoolBucket(length,charset,generator))
+        return bucket
+    def get(self,length,valid_chars):
+        # returns a password which has never been handed out before
+        # if the bucket is empty, the password is generated on the spot
+        if self.closed:
+            raise ValueError("PasswordPool is closed")
+        bucket = self.bucket(length,valid_chars)
+        with self.lock:
+            if self.closed:
+                raise ValueError("PasswordPool is closed")
+            entry = bucket.entries.popleft() if len(bucket.entries) > 0 else None
+            if len(bucket.entries) < self.low_watermark or entry is None:
+                self.request_refill(bucket)
+            if entry is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        if entry is None:
+            return bucket.generator.next_password(length)
+        password = entry.decode("UTF-8")
+        wipe(entry)
+        return password
+    def request_refill(self,bucket):
+        # must be called while holding lock
+        self.pending[id(bucket)] = bucket
+        self.wakeup.notify()
+    def refill(self,bucket,wait=False):
+        # generates passwords until bucket holds size of them
+        # only one refill of a bucket runs at a time: if another one
+        # is running, returns at once, or if wait is True,
+        # waits for it to finish and then tops the bucket up
+        with self.lock:
+            while bucket.refilling:
+                if not wait or self.closed:
+                    return
+                self.refilled.wait()
+            need = self.size - len(bucket.entries)
+            if need <= 0 or self.closed:
+                return
+            bucket.refilling = True
+        entries = []
+        try:
+            start = time.perf_counter()
+            length = bucket.length
+            if bucket.charset.ascii:
+                # the passwords are written straight into a buffer,
+                # which is wiped once they are copied into their entries
+                buffer = bytearray(need*length)
+                bucket.generator.fill(buffer)
+                entries = [buffer[index*length:(index+1)*length] for index in range(need)]
+                wipe(buffer)
+            else:
+                # characters beyond ASCII are generated as str,
+                # and those copies can't be wiped
+                passwords = bucket.generator.next_passwords(need,length)
+                entries = [bytearray(password,"UTF-8") for password in passwords]
+            elapsed = time.perf_counter() - start
+        finally:
+            # the entries are added in the same step as the flag is cleared,
+            # so a waiting refill never sees the bucket short
+            with self.lock:
+                bucket.refilling = False
+                self.refilled.notify_all()
+                if self.closed:
+                    for entry in entries:
+                        wipe(entry)
+                elif len(entries) > 0:
+                    bucket.entries.extend(entries)
+                    self.refills += 1
+                    self.refill_seconds += elapsed
+                    self.last_refill_seconds = elapsed
+    def refill_loop(self):
+        # runs in the background thread
+        while True:
+            with self.lock:
+                while len(self.pending) == 0 and not self.closed:
+                    self.wakeup.wait()
+                if self.closed:
+                    return
+                bucket = self.pending.popitem(last=False)[1]
+            self.refill(bucket)
+    def prefill(self,length,valid_chars):
+        # fills the bucket for (length, valid_chars) now,
+        # in the calling thread
+        self.refill(self.bucket(length,valid_chars),wait=True)
+    def fill_level(self,length,valid_chars):
+        # returns the number of passwords ready
+        # for (length, valid_chars)
+        self.check_fork()
+        with self.lock:
+            bucket = self.buckets.get((length,prepare_charset(valid_chars)))
+            return 0 if bucket is None else len(bucket.entries)
+    def stats(self):
+        # returns a dict of metrics
+        # fill maps (length, valid_chars) to the number of passwords ready
+        self.check_fork()
+        with self.lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "refills": self.refills,
+                "refill_seconds": self.refill_seconds,
+                "last_refill_seconds": self.last_refill_seconds,
+                "fill": {(bucket.length,bucket.charset.symbols): len(bucket.entries) for bucket in self.buckets.values()}
+            }
+    def close(self):
+        # stops the background thread,
+        # and wipes every password which was never handed out
+        self.check_fork()
+        with self.lock:
+            self.closed = True
+            self.wakeup.notify()
+            self.refilled.notify_all()
+            for bucket in self.buckets.values():
+                while len(bucket.entries) > 0:
+                    wipe(bucket.entries.popleft())
+        self.thread.join()
@@ -7,53 +7,135 @@ if sys.version_info[0] != 3 or sys.version_info[1] < 6:
     raise Exception("Python Password Utility requires Python 3.6 or later. Compatibility with any major versions after Python 3 is not guaranteed.")
 
 import hashlib
-import secrets
 import time
-from .chars import normalize_valid_chars, create_character_map
+from array import array
+from .backends import SHA512, SHA512_number, HashBackend, hash_backends, hash_backend, resolve_backend
+from .chars import compile_charset, IndexSampler, CODEPOINT_TYPECODE, CODEPOINT_CODEC
+from .entropy import EntropyPool, resolve_source
+from .policy import compile_policy
 
-# try to use SHA-3 if possible
-# default to SHA-2 if you have to
+class HashStates(object):
+    # the hash objects used by the generator, with their
+    # prefixes (and keys) already absorbed
+    # each step copies one of these states and
+    # feeds it only the values which change from step to step
+    def __init__(self,key,backend):
+        self.backend = backend
+        self.initialize = backend.keyed_state(b'initialize:',key)
+        self.prefix = backend.keyed_state(b'prefix:',key)
+        self.step = backend.keyed_state(b'step:',key)
+        self.password = backend.keyed_state(b'password:',key)
+        self.domain = backend.keyed_state(b'domain:',key)
+        self.output = backend.state(b'output:')
+        self.shake = hashlib.shake_256(b'output:')
 
-if "sha3_512" in hashlib.algorithms_available:
-    SHA512 = lambda x : hashlib.sha3_512(x).digest()
-    SHA512_number = 3
-else:
-    SHA512 = lambda x : hashlib.sha512(x).digest()
-    SHA512_number = 2
+def absorb(state,*parts):
+    # copies a prepared hash state and feeds it parts
+    # returns the copy, the prepared state is unchanged
+    h = state.copy()
+    for part in parts:
+        h.update(part)
+    return h
 
 class UniqueCounter(object):
     # this class is used to guarantee
     # that the input to every hash
     # is different
-    def __init__(self):
+    def __init__(self,legacy=False,source=None):
         # set the internal state to a random integer
-        # 0 <= n < 2**128
-        self.n = 0
-        for i in range(16):
-            self.n = (self.n*256) + secrets.randbelow(256)
+        # 0 <= n < 2**128, drawn from source
+        self.n = int.from_bytes(resolve_source(source).random_bytes(16),"big")
+        # legacy counters use the decimal encoding
+        # from earlier versions
+        self.legacy = legacy
     def __call__(self):
         # return the internal state
-        # as a decimal number,
-        # in a bytes format.
-        # increment the internal state.
-        s = str(self.n) + ":"
-        self.n += 1
-        return s.encode("UTF-8")
-
-def time_hash():
+        # as a 16 byte big-endian number.
+        # increment the internal state,
+        # wrapping around at 2**128.
+        if self.legacy:
+            # the internal state as a decimal number
+            # followed by ":", in a bytes format
+            s = str(self.n) + ":"
+            self.n += 1
+            return s.encode("UTF-8")
+        s = self.n.to_bytes(16,"big")
+        self.n = (self.n + 1) & COUNTER_MASK
+        return s
+
+COUNTER_MASK = (1 << 128) - 1
+
+# generation modes
+# "standard" selects one random byte from each candidate
+# "high_yield" uses every byte of each candidate
+# "shake" draws the candidate bytes from a SHAKE-256 stream
+# "batched" is the same as "shake", but next_passwords draws
+# the whole batch as a single stream
+modes = ("standard","high_yield","shake","batched")
+
+# samplers
+# "byte" maps single bytes through the character map
+# "index" uses an IndexSampler, which rejects far fewer values
+samplers = ("byte","index")
+
+# the number of bytes in each IndexSampler block, by mode
+# in standard mode, one block is selected from each candidate
+SAMPLER_WIDTHS = {"standard": 2, "high_yield": 8, "shake": 8, "batched": 8}
+
+def sampler_width(mode,size):
+    # the number of bytes in each IndexSampler block
+    # large Unicode charsets need wider blocks than SAMPLER_WIDTHS,
+    # so that fewer than 1 in 128 blocks are rejected
+    width = SAMPLER_WIDTHS[mode]
+    while size * 128 > 256 ** width:
+        width *= 2
+    return width
+
+# the number of characters produced at a time
+# when streaming or filling a buffer
+STREAM_CHUNK_SIZE = 65536
+
+# the largest number of bytes that will be requested from
+# a single SHAKE-256 stream, before garbage is updated again
+SHAKE_MAX_BYTES = 1 << 20
+
+def time_hash(backend=None,source=None):
     # a hash based on the current time
-    t = time.time()
-    t = "{:1.20f}".format(t)
-    # include 20 decimal points of the time
-    # this will include sub-precision garbage
-    t = t.encode("UTF-8")
-    return SHA512(t)
-
-def generate_password(length,key,valid_chars):
+    # the generator now uses entropy.time_stamp instead,
+    # this is kept for compatibility
+    if source is not None:
+        # the time stamp of source, instead of the clock
+        t = resolve_source(source).time_stamp()
+    else:
+        t = time.time()
+        t = "{:1.20f}".format(t)
+        # include 20 decimal points of the time
+        # this will include sub-precision garbage
+        t = t.encode("UTF-8")
+    if backend is None:
+        return SHA512(t)
+    return backend.digest(t)
+
+def check_length(length,name="length"):
+    # length must be a nonnegative int
     if type(length) != int:
-        raise TypeError("length parameter must be int")
+        raise TypeError(name+" parameter must be int")
     if length < 0:
-        raise ValueError("length parameter must be nonnegative")
+        raise ValueError(name+" parameter must be nonnegative")
+
+def check_option(value,name,options):
+    # value must be one of the str in options
+    if type(value) != str:
+        raise TypeError(name+" parameter must be str")
+    if value not in options:
+        raise ValueError(name+" parameter must be one of: "+", ".join(options))
+
+def check_mode(mode):
+    # mode must name one of the generation modes
+    check_option(mode,"mode",modes)
+
+def normalize_key(key):
+    # returns key as a nonempty bytes object
     if type(key) != bytes:
         if type(key) == str:
             key = key.encode("UTF-8")
@@ -61,40 +143,83 @@ def generate_password(length,key,valid_chars):
             raise TypeError("key parameter must be bytes or str")
     if len(key) < 1:
         raise ValueError("key parameter has minimum length 1")
-    valid_chars = normalize_valid_chars(valid_chars)
-    if len(valid_chars) < 1:
+    return key
+
+def prepare_charset(valid_chars):
+    # resolves valid_chars to a nonempty Charset
+    charset = compile_charset(valid_chars)
+    if len(charset) < 1:
         raise ValueError("valid_chars parameter has minimum size 1")
-    char_map = create_character_map(valid_chars)
-    # length is a nonnegative integer
-    # key is a nonempty bytes object
-    # valid_chars is a nonempty set(int)
-    # it indicates which characters are allowed to be in the
-    # password, uses ascii codes
-    # char_map is a list of length 256
-    # it maps indicies to characters in valid_chars
-    # or to None
-    # SHA512 has an output size of 64 bytes
-    garbage = SHA512( b'initialize:' + key )
+    return charset
+
+def initialize_garbage(states,counter,pool,garbage=None):
+    # all backends have an output size of 64 bytes
+    # when reseeding, the previous garbage is tumbled together
+    # with the new key instead of starting over
+    time_stamp = pool.source.time_stamp
+    if garbage is None:
+        garbage = states.initialize.digest()
     # garbage holds the state of the password generator
     # it is called garbage because, while deterministicly generated,
     # it should not have any sensible interpretation
-    counter = UniqueCounter()
     for i in range(3):
         # tumble the bits around
         # but don't extract any password characters yet
-        garbage = SHA512( b'prefix:' + counter() + garbage + time_hash() + secrets.token_bytes(64) + key )
+        garbage = absorb( states.prefix, counter(), garbage, time_stamp(), pool.take(64) ).digest()
     # the value of garbage should be sufficiently random at this point,
     # totally disconnected from the input values
-    password = [] # store it as a list of ascii values, convert to a string later
+    return garbage
+
+def extend_password_shake(password,length,garbage,counter,states,charset,pool):
+    # the same as extend_password, but each candidate is a
+    # SHAKE-256 stream which is exactly as long as we expect to need
+    table = charset.table
+    rejected = charset.rejected
+    accepted = 256 - len(rejected)
+    time_stamp = pool.source.time_stamp
+    while len(password) < length:
+        garbage = absorb( states.step, counter(), garbage, time_stamp(), pool.take(64) ).digest()
+        # on average, accepted out of every 256 bytes will become characters
+        # request enough bytes to finish the password, plus a small margin
+        # if too many bytes are rejected, the loop will run again
+        # with a new value of garbage
+        remaining = length - len(password)
+        size = (remaining * 256) // accepted + 16
+        size = min(size,SHAKE_MAX_BYTES)
+        candidate = absorb( states.shake, counter(), garbage, time_stamp(), pool.take(64) ).digest(size)
+        # map every byte through table, dropping the rejected ones
+        candidate = candidate.translate(table,rejected)
+        password.extend(candidate[:remaining])
+    return garbage
+
+def extend_password(password,length,garbage,counter,states,char_map,mode,pool):
+    # appends ascii values to password until it has the given length
+    # password is a bytearray
+    # char_map maps bytes to characters, or to 0 if they are rejected
+    # returns the updated garbage
+    time_stamp = pool.source.time_stamp
     while len(password) < length: # this is the password generation loop
         # update garbage
-        garbage = SHA512( b'step:' + counter() + garbage + time_hash() + secrets.token_bytes(64) + key )
+        garbage = absorb( states.step, counter(), garbage, time_stamp(), pool.take(64) ).digest()
         # use garbage to generate another sequence of bytes which will not
         # have any effect on future values of garbage
-        candidate = SHA512( b'output:' + counter() + garbage + time_hash() + secrets.token_bytes(64) )
+        candidate = absorb( states.output, counter(), garbage, time_stamp(), pool.take(64) ).digest()
         # candidate should have nothing in common with future or past values of garbage
+        if mode == "high_yield":
+            # every byte of candidate is an independent, uniformly
+            # distributed value, so each one may be passed through
+            # char_map in turn, instead of discarding all but one
+            for value in candidate:
+                value = char_map[value]
+                if value:
+                    password.append(value)
+                    if len(password) == length:
+                        break
+            continue
         # select a single value from those bytes
-        value = candidate[secrets.randbelow(len(candidate))]
+        # candidate has 64 bytes, so the low 6 bits
+        # of a random byte select one uniformly
+        value = candidate[pool.take(1)[0] & 63]
         # predicting value is very very difficult
         # determining garbage from value requires inverting
         # a SHA512 hash (a hash which isn't even known to
@@ -104,8 +229,237 @@ def generate_password(length,key,valid_chars):
         # now convert value to a usable character
         value = char_map[value]
         # value is now a valid character codepoint
-        # or None
-        if value is not None:
+        # or 0
+        if value:
             password.append(value)
-    # convert to a string
-    return bytes(password).decode("UTF-8")
+    return garbage
+
+def extend_password_index(password,length,garbage,counter,states,sampler,mode,pool):
+    # the same as extend_password, but candidate bytes
+    # are turned into characters by an IndexSampler
+    width = sampler.width
+    blocks = 64 // width
+    # the expected number of characters from each block
+    per_block = sampler.digits * (1 - sampler.rejection_rate)
+    time_stamp = pool.source.time_stamp
+    while len(password) < length:
+        garbage = absorb( states.step, counter(), garbage, time_stamp(), pool.take(64) ).digest()
+        if mode == "shake" or mode == "batched":
+            remaining = length - len(password)
+            size = (int(remaining / per_block) + 2) * width
+            size = min(size,SHAKE_MAX_BYTES - SHAKE_MAX_BYTES % width)
+            candidate = absorb( states.shake, counter(), garbage, time_stamp(), pool.take(64) ).digest(size)
+            sampler.sample(candidate,password,length)
+            continue
+        candidate = absorb( states.output, counter(), garbage, time_stamp(), pool.take(64) ).digest()
+        if mode == "high_yield":
+            # every block of candidate is used
+            sampler.sample(candidate,password,length)
+            continue
+        # select a single block from candidate
+        # and take a single character from it
+        offset = (pool.take(1)[0] % blocks) * width
+        value = int.from_bytes(candidate[offset:offset+width],"big")
+        if value < sampler.limit:
+            password.append(sampler.symbols[value % sampler.size])
+    return garbage
+
+class PasswordGenerator(object):
+    # holds the state of the hash chain between calls,
+    # so that it only needs to be set up once
+    # key, valid_chars, mode, backend, sampler, and source are the same
+    # as in generate_password
+    __slots__ = ("mode","backend","states","charset","sampler","rejection_rate","counter","pool","garbage")
+    def __init__(self,key,valid_chars,mode="standard",backend=None,sampler="byte",source=None):
+        check_mode(mode)
+        check_option(sampler,"sampler",samplers)
+        source = resolve_source(source)
+        self.mode = mode
+        self.backend = resolve_backend(backend)
+        self.states = HashStates(self.backend.prepare_key(normalize_key(key)),self.backend)
+        # charset.table is a bytes object of length 256
+        # it maps indicies to characters in valid_chars
+        # or to 0
+        self.charset = prepare_charset(valid_chars)
+        if sampler == "index" or not self.charset.ascii:
+            # charsets beyond ASCII have no table,
+            # so they are always sampled by index
+            self.sampler = IndexSampler(self.charset,sampler_width(mode,len(self.charset)))
+            self.rejection_rate = self.sampler.rejection_rate
+        else:
+            self.sampler = None
+            self.rejection_rate = len(self.charset.rejected) / 256
+        self.counter = UniqueCounter(source=source)
+        self.pool = EntropyPool(source=source)
+        self.garbage = initialize_garbage(self.states,self.counter,self.pool)
+    def check_fork(self):
+        # a forked child starts with a copy of its parent's state
+        # once the pool has thrown away its copied bytes, the counter
+        # is redrawn and the state is tumbled with fresh bytes,
+        # so the two processes no longer share a hash chain
+        if self.pool.check_fork():
+            self.counter.n = int.from_bytes(self.pool.take(16),"big")
+            self.garbage = initialize_garbage(self.states,self.counter,self.pool,self.garbage)
+    def new_buffer(self):
+        # ASCII characters are collected in a bytearray,
+        # others as codepoints in an array
+        if self.charset.ascii:
+            return bytearray()
+        return array(CODEPOINT_TYPECODE)
+    def decode(self,password):
+        # returns the characters in a buffer from new_buffer as a str
+        if self.charset.ascii:
+            return password.decode("UTF-8")
+        return password.tobytes().decode(CODEPOINT_CODEC)
+    def extend(self,password,length):
+        # appends characters to password until it has the given length
+        # password is a buffer from new_buffer
+        if self.sampler is not None:
+            self.garbage = extend_password_index(password,length,self.garbage,self.counter,self.states,self.sampler,self.mode,self.pool)
+        elif self.mode == "shake" or self.mode == "batched":
+            self.garbage = extend_password_shake(password,length,self.garbage,self.counter,self.states,self.charset,self.pool)
+        else:
+            self.garbage = extend_password(password,length,self.garbage,self.counter,self.states,self.charset.table,self.mode,self.pool)
+    def next_bytes(self,n):
+        # returns the next n characters of the hash chain
+        # as UTF-8 encoded bytes, which is ascii for ASCII charsets
+        check_length(n,"n")
+        self.check_fork()
+        password = self.new_buffer() # store it as codepoints, convert to a string later
+        self.extend(password,n)
+        if self.charset.ascii:
+            return bytes(password)
+        return self.decode(password).encode("UTF-8")
+    def next_chars(self,n):
+        # returns the next n characters of the hash chain as a str
+        check_length(n,"n")
+        self.check_fork()
+        password = self.new_buffer()
+        self.extend(password,n)
+        return self.decode(password)
+    def fill(self,buffer):
+        # fills a writable buffer (such as a bytearray) in place
+        # with ascii encoded characters from the hash chain
+        # the characters are generated STREAM_CHUNK_SIZE at a time,
+        # so memory use does not grow with the size of buffer
+        if not self.charset.ascii:
+            # characters beyond ASCII take more than one byte,
+            # so they cannot be written one per byte
+            raise ValueError("fill requires an ASCII charset")
+        view = memoryview(buffer)
+        if view.readonly:
+            raise TypeError("buffer parameter must be writable")
+        view = view.cast("B")
+        self.check_fork()
+        position = 0
+        while position < len(view):
+            n = min(STREAM_CHUNK_SIZE,len(view)-position)
+            # chunk is overwritten once it is copied into buffer,
+            # so that it doesn't leave a copy of the characters behind
+            chunk = self.new_buffer()
+            self.extend(chunk,n)
+            view[position:position+n] = chunk
+            chunk[:] = bytes(n)
+            position += n
+        return len(view)
+    def next_password(self,length,policy=None):
+        # returns a new password of the given length
+        # if policy is a Policy, the password satisfies it,
+        # and is drawn uniformly from the passwords which do
+        check_length(length)
+        if policy is not None:
+            return compile_policy(policy,self.charset).sample(self,length)
+        # domain separation:
+        # every password starts with its own 'password:' step,
+        # which draws a fresh counter value, time stamp, and random bytes
+        # since the counter never repeats, no hash input is ever
+        # shared between two passwords, and each password is as
+        # independent of the others as two separate calls
+        # to generate_password would be
+        self.check_fork()
+        self.garbage = absorb( self.states.password, self.counter(), self.garbage, self.pool.source.time_stamp(), self.pool.take(64) ).digest()
+        password = self.new_buffer()
+        self.extend(password,length)
+        return self.decode(password)
+    def next_indices(self,count,size):
+        # returns an array of count independent, uniformly distributed
+        # integers below size, such as the indices of words in a wordlist
+        # like a password, the indices start with their own 'password:' step
+        check_length(count,"count")
+        check_length(size,"size")
+        if size < 1 or size > 2**32:
+            raise ValueError("size parameter must be between 1 and 2**32")
+        sampler = IndexSampler(range(size),sampler_width(self.mode,size))
+        self.check_fork()
+        self.garbage = absorb( self.states.password, self.counter(), self.garbage, self.pool.source.time_stamp(), self.pool.take(64) ).digest()
+        indices = array(CODEPOINT_TYPECODE)
+        self.extend_indices(indices,count,sampler)
+        return indices
+    def extend_indices(self,indices,count,sampler):
+        # appends indices from sampler until there are count of them
+        self.garbage = extend_password_index(indices,count,self.garbage,self.counter,self.states,sampler,self.mode,self.pool)
+    def next_passwords(self,count,length,policy=None):
+        # returns a list of count new passwords of the given length
+        check_length(count,"count")
+        check_length(length)
+        if self.mode != "batched" or policy is not None:
+            return [self.next_password(length,policy) for i in range(count)]
+        # in batched mode, the whole batch is drawn as a single stream
+        # after a single 'password:' step, and then sliced into passwords
+        # the characters of the stream are independent of one another,
+        # so the passwords are too
+        self.check_fork()
+        self.garbage = absorb( self.states.password, self.counter(), self.garbage, self.pool.source.time_stamp(), self.pool.take(64) ).digest()
+        batch = self.next_chars(count*length)
+        return [batch[index*length:(index+1)*length] for index in range(count)]
+    def separate(self,domain):
+        # mixes domain, a bytes object, into the state
+        # generators which are given different domains
+        # never share a hash input, even if they were
+        # somehow to share the rest of their state
+        self.check_fork()
+        self.garbage = absorb( self.states.domain, len(domain).to_bytes(8,"big"), domain, self.counter(), self.garbage, self.pool.source.time_stamp(), self.pool.take(64) ).digest()
+    def reseed(self,key):
+        # replaces the key, and tumbles the new key
+        # into the existing state
+        self.check_fork()
+        self.states = HashStates(self.backend.prepare_key(normalize_key(key)),self.backend)
+        self.garbage = initialize_garbage(self.states,self.counter,self.pool,self.garbage)
+
+def generate_password(length,key,valid_chars,mode="standard",backend=None,sampler="byte",policy=None,source=None):
+    check_length(length)
+    if policy is not None:
+        return PasswordGenerator(key,valid_chars,mode,backend,sampler,source).next_password(length,policy)
+    return PasswordGenerator(key,valid_chars,mode,backend,sampler,source).next_chars(length)
+
+def generate_passwords(count,length,key,valid_chars,mode="standard",backend=None,sampler="byte",policy=None,source=None):
+    # generates count passwords, each of the given length
+    # validation, the character map, the counter, and the
+    # initial tumbling are shared by all of the passwords
+    check_length(count,"count")
+    check_length(length)
+    return PasswordGenerator(key,valid_chars,mode,backend,sampler,source).next_passwords(count,length,policy)
+
+def iter_password_chars(key,valid_chars,chunk_size=STREAM_CHUNK_SIZE,length=None,binary=False,mode="standard",backend=None,sampler="byte",source=None):
+    # lazily yields the characters of a password in chunks of chunk_size
+    # the chunks are str, or ascii encoded bytes if binary is True
+    # if length is None, the stream never ends
+    # otherwise the chunks add up to length characters
+    check_length(chunk_size,"chunk_size")
+    if chunk_size < 1:
+        raise ValueError("chunk_size parameter has minimum 1")
+    if length is not None:
+        check_length(length)
+    generator = PasswordGenerator(key,valid_chars,mode,backend,sampler,source)
+    produced = 0
+    while length is None or produced < length:
+        n = chunk_size if length is None else min(chunk_size,length-produced)
+        chunk = generator.next_bytes(n)
+        produced += n
+        yield chunk if binary else chunk.decode("UTF-8")
+
+def generate_password_into(buffer,key,valid_chars,mode="standard",backend=None,sampler="byte",source=None):
+    # fills a writable buffer, such as a bytearray or memoryview,
+    # with an ascii encoded password as long as the buffer
+    # returns the number of bytes written
+    return PasswordGenerator(key,valid_chars,mode,backend,sampler,source).fill(buffer)
@@ -0,0 +1,180 @@
+# Copyright Aaron Stanek 2021
+# See LICENSE for more details
+
+import asyncio
+import collections
+import os
+import signal
+import socket
+import stat
+from .pu import check_length, check_mode, resolve_backend, normalize_key, prepare_charset
+from .threadsafe import ThreadSafeGenerator
+from .aio import run
+from .client import default_socket_path, check_unix_sockets
+
+# the number of charsets which keep a warm generator
+SERVER_MAX_GENERATORS = 64
+
+# the longest request line accepted, in bytes
+SERVER_MAX_LINE = 4096
+
+# the longest password, and the most passwords, a request may ask for
+SERVER_MAX_LENGTH = 1 << 16
+SERVER_MAX_COUNT = 1 << 20
+
+# the number of characters generated in a single batch
+# batches run in the executor, so the event loop keeps serving other
+# clients, and small batches share the executor threads fairly
+SERVER_BATCH_CHARS = 16384
+
+# requests for up to this many characters take microseconds,
+# and are answered on the event loop, without the trip to the executor
+SERVER_INLINE_CHARS = 1024
+
+def parse_request(line):
+    # returns valid_chars, length, count, and key from a request line
+    fields = line.split(" ",3)
+    if len(fields) < 3:
+        raise ValueError("expected <valid_chars> <length> <count> <key, optional>")
+    try:
+        length = int(fields[1])
+        count = int(fields[2])
+    except ValueError:
+        raise TypeError("length and count parameters should be integers")
+    check_length(length)
+    check_length(count,"count")
+    if length > SERVER_MAX_LENGTH:
+        raise ValueError("length parameter has maximum "+str(SERVER_MAX_LENGTH))
+    if count > SERVER_MAX_COUNT:
+        raise ValueError("count parameter has maximum "+str(SERVER_MAX_COUNT))
+    key = fields[3] if len(fields) > 3 else ""
+    return fields[0], length, count, key
+
+class PasswordServer(object):
+    # answers requests from passutil.client on a Unix domain socket
+    # each request is a single line, as made by client.format_request
+    # the response is "OK <count>\n" followed by the passwords, one per line,
+    # or "ERR <message>\n"
+    # a connection may make any number of requests
+    # a ThreadSafeGenerator is kept for each recently used charset,
+    # so that a request only pays for its own passwords
+    # large requests are generated in batches in executor, or the
+    # default executor of passutil.aio if it is None
+    def __init__(self,key,backend=None,mode="shake",executor=None):
+        check_mode(mode)
+        self.key = normalize_key(key)
+        self.backend = resolve_backend(backend).name
+        self.mode = mode
+        self.executor = executor
+        self.generators = collections.OrderedDict()
+        self.requests = 0
+    def generator(self,valid_chars):
+        # returns the generator for valid_chars,
+        # creating it, and forgetting the least recently used one, if needed
+        charset = prepare_charset(valid_chars)
+        generator = self.generators.pop(charset,None)
+        if generator is None:
+            generator = ThreadSafeGenerator(self.key,charset,self.mode,self.backend)
+            if len(self.generators) >= SERVER_MAX_GENERATORS:
+                self.generators.popitem(last=False)
+        self.generators[charset] = generator
+        return generator
+    async def respond(self,line,writer):
+        valid_chars, length, count, key = parse_request(line)
+        generator = self.generator(valid_chars)
+        key = key.encode("UTF-8")
+        self.requests += 1
+        writer.write(b'OK '+str(count).encode("UTF-8")+b'\n')
+        if count * length <= SERVER_INLINE_CHARS:
+            writer.write(generate_batch(generator,count,length,key))
+            return
+        batch_size = max(1,SERVER_BATCH_CHARS // max(1,length))
+        while count > 0:
+            n = min(batch_size,count)
+            writer.write(await run(self.executor,generate_batch,generator,n,length,key))
+            # the client's key only needs to be mixed in once
+            key = b''
+            count -= n
+            await writer.drain()
+    async def handle(self,reader,writer):
+        # serves a single connection until the client stops sending
+        try:
+            while True:
+                try:
+                    line = await reader.readline()
+                except ValueError:
+                    writer.write(b'ERR request is too long\n')
+                    break
+                if len(line) == 0:
+                    break
+                try:
+                    await self.respond(line.decode("UTF-8").rstrip("\r\n"),writer)
+                except (TypeError,ValueError) as ex:
+                    writer.write(("ERR "+str(ex).replace("\n"," ")+"\n").encode("UTF-8"))
+                await writer.drain()
+        except ConnectionError:
+            # the client went away
+            pass
+        finally:
+            writer.close()
+
+def generate_batch(generator,count,length,key):
+    # returns count passwords as UTF-8 bytes, each followed by a newline
+    # the client's key, if any, adds to the state of the
+    # generator of the calling thread
+    if len(key) > 0:
+        generator.generator().separate(key)
+    return "".join(password+"\n" for password in generator.next_passwords(count,length)).encode("UTF-8")
+
+def remove_stale_socket(path):
+    # removes a socket file left behind by a server which has stopped
+    # raises ValueError if a server is still listening on it,
+    # or if path is some other kind of file
+    if not os.path.exists(path):
+        return
+    if not stat.S_ISSOCK(os.stat(path).st_mode):
+        raise ValueError(path+" already exists, and is not a socket")
+    probe = socket.socket(socket.AF_UNIX,socket.SOCK_STREAM)
+    try:
+        probe.connect(path)
+    except OSError:
+        os.unlink(path)
+        return
+    finally:
+        probe.close()
+    raise ValueError("a server is already listening on "+path)
+
+async def start_server(key,path=None,backend=None,mode="shake",executor=None):
+    # starts a PasswordServer listening on path
+    # returns the asyncio Server
+    # the socket is only accessible to the user running the server
+    check_unix_sockets()
+    if path is None:
+        path = default_socket_path(create=True)
+    handler = PasswordServer(key,backend,mode,executor)
+    remove_stale_socket(path)
+    umask = os.umask(0o177)
+    try:
+        return await asyncio.start_unix_server(handler.handle,path,limit=SERVER_MAX_LINE)
+    finally:
+        os.umask(umask)
+
+def serve(key,path=None,backend=None,mode="shake"):
+    # runs a PasswordServer on path until SIGINT or SIGTERM
+    # the socket file is removed when the server stops
+    if path is None:
+        path = default_socket_path(create=True)
+    loop = asyncio.new_event_loop()
+    try:
+        server = loop.run_until_complete(start_server(key,path,backend,mode))
+        for signum in (signal.SIGINT,signal.SIGTERM):
+            loop.add_signal_handler(signum,loop.stop)
+        try:
+            loop.run_forever()
+        finally:
+            server.close()
+            loop.run_until_complete(server.wait_closed())
+            if os.path.exists(path):
+                os.unlink(path)
+    finally:
+        loop.close()
@@ -0,0 +1,238 @@
+# Copyright Aaron Stanek 2021
+# See LICENSE for more details
+
+import threading
+import time
+from . import pu
+from . import chars
+from . import entropy
+
+# instrumentation for the hot path
+# while stats are disabled, nothing here is ever called:
+# the generator runs the same functions it always does
+# enable_stats swaps the functions used by pu.py for counting
+# versions, and disable_stats puts the originals back
+# stats are only collected in this process,
+# not in the workers of generate_passwords_parallel
+
+if hasattr(time,"perf_counter_ns"):
+    perf_ns = time.perf_counter_ns
+else:
+    # Python 3.6 has no nanosecond clocks
+    def perf_ns():
+        return int(time.perf_counter()*1e9)
+
+# the counters, and what they measure
+counter_names = (
+    "hashes",               # hash digests computed
+    "hash_ns",              # time spent copying, updating, and finalizing hash states
+    "random_bytes",         # bytes drawn from the OS by EntropyPool refills
+    "random_draws",         # EntropyPool refills
+    "random_ns",            # time spent in EntropyPool refills
+    "clock_calls",          # time stamps taken
+    "clock_ns",             # time spent taking time stamps
+    "candidates",           # candidate hashes, which are turned into characters
+    "candidate_bytes",      # bytes in those candidates
+    "chars",                # characters, or indices from next_indices, produced
+    "rejected",             # candidate values which did not become characters
+    "extend_calls",         # calls to PasswordGenerator.extend and extend_indices
+    "extend_ns",            # time spent in those calls, including the above
+    "charset_lookups",      # calls to compile_charset
+    "charset_misses",       # of those, the ones which had to build a new Charset
+    "charset_ns"            # time spent in compile_charset
+)
+
+class GenerationStats(object):
+    # cumulative counters, shared by every thread
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+    def reset(self):
+        with self.lock:
+            self.counters = dict.fromkeys(counter_names,0)
+    def add(self,**amounts):
+        with self.lock:
+            for name, amount in amounts.items():
+                self.counters[name] += amount
+    def snapshot(self):
+        with self.lock:
+            return dict(self.counters)
+
+stats = GenerationStats()
+
+# hooks are called after each call to PasswordGenerator.extend and extend_indices
+hooks = []
+
+# the originals, while stats are enabled
+# the counting versions capture their originals when they are made,
+# so they never look here, and can finish after stats are disabled
+originals = None
+
+# taken by enable_stats and disable_stats, so that two threads
+# can't both save the functions they swap out
+switch_lock = threading.Lock()
+
+# the states of the generator running in this thread,
+# and the candidates it has produced in the current call
+local = threading.local()
+
+class CountingHash(object):
+    # wraps a hash object returned by absorb,
+    # and counts the digest
+    __slots__ = ("h","ns","candidate")
+    def __init__(self,h,ns,candidate):
+        self.h = h
+        self.ns = ns
+        self.candidate = candidate
+    def digest(self,*size):
+        start = perf_ns()
+        output = self.h.digest(*size)
+        ns = self.ns + perf_ns() - start
+        stats.add(hashes=1,hash_ns=ns)
+        if self.candidate:
+            local.candidates += 1
+            local.candidate_bytes += len(output)
+        return output
+
+def counting_absorb(absorb):
+    def counted(state,*parts):
+        start = perf_ns()
+        h = absorb(state,*parts)
+        states = getattr(local,"states",None)
+        candidate = states is not None and (state is states.output or state is states.shake)
+        return CountingHash(h,perf_ns()-start,candidate)
+    return counted
+
+def counting_time_stamp(time_stamp):
+    # only the SystemSource is counted
+    # a generator given another source takes its time stamps uncounted
+    def counted():
+        start = perf_ns()
+        output = time_stamp()
+        stats.add(clock_calls=1,clock_ns=perf_ns()-start)
+        return output
+    return counted
+
+def counting_refill(refill):
+    def counted(self,minimum=0):
+        start = perf_ns()
+        refill(self,minimum)
+        stats.add(random_bytes=len(self.view),random_draws=1,random_ns=perf_ns()-start)
+    return counted
+
+def counting_compile_charset(compile_charset):
+    def counted(x):
+        misses = chars.cached_charset.cache_info().misses
+        start = perf_ns()
+        output = compile_charset(x)
+        ns = perf_ns() - start
+        stats.add(charset_lookups=1,charset_misses=chars.cached_charset.cache_info().misses-misses,charset_ns=ns)
+        return output
+    return counted
+
+def examined_values(mode,sampler,candidates,candidate_bytes):
+    # the number of values the samplers looked at
+    # in standard mode, one value is taken from each candidate
+    # otherwise, every byte (or IndexSampler digit) of each candidate is used,
+    # and the unused end of the last candidate counts as rejected
+    if mode == "standard":
+        return candidates
+    if sampler is None:
+        return candidate_bytes
+    return candidate_bytes // sampler.width * sampler.digits
+
+def counted_extend(generator,output,function,kind,sampler,size,*args):
+    # calls function(generator,output,*args), which appends to output,
+    # and counts what it did
+    before = len(output)
+    local.states = generator.states
+    local.candidates = 0
+    local.candidate_bytes = 0
+    start = perf_ns()
+    try:
+        function(generator,output,*args)
+    finally:
+        local.states = None
+    ns = perf_ns() - start
+    record = {
+        "kind": kind,
+        "mode": generator.mode,
+        "sampler": "byte" if sampler is None else "index",
+        "backend": generator.backend.name,
+        "charset_size": size,
+        "chars": len(output) - before,
+        "candidates": local.candidates,
+        "candidate_bytes": local.candidate_bytes,
+        "ns": ns
+    }
+    record["rejected"] = examined_values(generator.mode,sampler,record["candidates"],record["candidate_bytes"]) - record["chars"]
+    stats.add(candidates=record["candidates"],candidate_bytes=record["candidate_bytes"],
+        chars=record["chars"],rejected=record["rejected"],extend_calls=1,extend_ns=ns)
+    for hook in list(hooks):
+        hook(record)
+
+def counting_extend(extend):
+    def counted(self,password,length):
+        counted_extend(self,password,extend,"chars",self.sampler,len(self.charset),length)
+    return counted
+
+def counting_extend_indices(extend_indices):
+    # the indices of passphrases and policies
+    def counted(self,indices,count,sampler):
+        counted_extend(self,indices,extend_indices,"indices",sampler,len(sampler.symbols),count,sampler)
+    return counted
+
+def enable_stats(hook=None):
+    # starts counting
+    # hook, if given, is added to the hooks
+    # each hook is called with a dict describing a single
+    # call to PasswordGenerator.extend, after it completes
+    global originals
+    if hook is not None and not callable(hook):
+        raise TypeError("hook parameter must be callable")
+    with switch_lock:
+        if hook is not None:
+            hooks.append(hook)
+        if originals is not None:
+            return
+        originals = {
+            "absorb": pu.absorb,
+            "time_stamp": entropy.SystemSource.time_stamp,
+            "compile_charset": pu.compile_charset,
+            "refill": entropy.EntropyPool.refill,
+            "extend": pu.PasswordGenerator.extend,
+            "extend_indices": pu.PasswordGenerator.extend_indices
+        }
+        pu.absorb = counting_absorb(originals["absorb"])
+        entropy.SystemSource.time_stamp = staticmethod(counting_time_stamp(originals["time_stamp"]))
+        pu.compile_charset = counting_compile_charset(originals["compile_charset"])
+        entropy.EntropyPool.refill = counting_refill(originals["refill"])
+        pu.PasswordGenerator.extend = counting_extend(originals["extend"])
+        pu.PasswordGenerator.extend_indices = counting_extend_indices(originals["extend_indices"])
+
+def disable_stats():
+    # stops counting, and removes every hook
+    # the counters keep their values
+    global originals
+    with switch_lock:
+        del hooks[:]
+        if originals is None:
+            return
+        pu.absorb = originals["absorb"]
+        entropy.SystemSource.time_stamp = staticmethod(originals["time_stamp"])
+        pu.compile_charset = originals["compile_charset"]
+        entropy.EntropyPool.refill = originals["refill"]
+        pu.PasswordGenerator.extend = originals["extend"]
+        pu.PasswordGenerator.extend_indices = originals["extend_indices"]
+        originals = None
+
+def stats_enabled():
+    return originals is not None
+
+def get_stats():
+    # returns a dict of the counters
+    return stats.snapshot()
+
+def reset_stats():
+    # sets every counter to 0
+    stats.reset()
@@ -0,0 +1,34 @@
+# Copyright Aaron Stanek 2021
+# See LICENSE for more details
+
+# helpers for tests and benchmarks
+# NOTHING IN THIS MODULE IS RANDOM
+# passwords generated with these helpers can be reproduced
+# by anyone who knows the seed, and must never be used
+
+import hashlib
+from .entropy import EntropySource, pack_time
+
+class DeterministicSource(EntropySource):
+    # an EntropySource which gives the same bytes and time stamps
+    # every time it is created with the same seed
+    # a generator given a fresh DeterministicSource produces
+    # the same passwords on every run, and on every release
+    # which has not changed how passwords are generated
+    # random_bytes is SHAKE-256 of the seed and the number of the call
+    # time_stamp counts up by one nanosecond on each call
+    def __init__(self,seed=b''):
+        if type(seed) == str:
+            seed = seed.encode("UTF-8")
+        if type(seed) != bytes:
+            raise TypeError("seed parameter must be bytes or str")
+        self.seed = seed
+        self.calls = 0
+        self.ticks = 0
+    def random_bytes(self,n):
+        output = hashlib.shake_256(b'random:' + self.calls.to_bytes(8,"big") + self.seed).digest(n)
+        self.calls += 1
+        return output
+    def time_stamp(self):
+        self.ticks += 1
+        return pack_time(self.ticks,self.ticks)
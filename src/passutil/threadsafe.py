@@ -0,0 +1,71 @@
+# Copyright Aaron Stanek 2021
+# See LICENSE for more details
+
+import threading
+from .pu import PasswordGenerator, UniqueCounter, normalize_key, prepare_charset
+
+class ThreadSafeGenerator(object):
+    # a PasswordGenerator which may be shared between threads
+    # every thread gets its own PasswordGenerator the first time it
+    # uses this object, so the hot path never takes a lock
+    # each per-thread generator draws its own entropy from the OS,
+    # and is separated from the others by a unique domain
+    # key, valid_chars, mode, backend, and sampler are the same
+    # as in generate_password
+    # the default mode is "shake", the fastest for a single thread
+    # most of the work holds the GIL, so threads do not
+    # generate passwords in parallel
+    __slots__ = ("key","charset","mode","backend","sampler","epoch","counter","lock","local")
+    def __init__(self,key,valid_chars,mode="shake",backend=None,sampler="byte"):
+        self.key = normalize_key(key)
+        self.charset = prepare_charset(valid_chars)
+        self.mode = mode
+        self.backend = backend
+        self.sampler = sampler
+        # epoch counts the calls to reseed,
+        # so that each thread knows when to reseed its generator
+        self.epoch = 0
+        # counter provides the domain separators
+        # lock protects it, and is only taken when
+        # a thread creates or reseeds its generator
+        self.counter = UniqueCounter()
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        # create the generator for this thread now,
+        # so that any invalid parameters raise here
+        self.generator()
+    def generator(self):
+        # returns the PasswordGenerator for the calling thread
+        local = self.local
+        generator = getattr(local,"generator",None)
+        if generator is not None and local.epoch == self.epoch:
+            return generator
+        with self.lock:
+            key = self.key
+            epoch = self.epoch
+            domain = self.counter()
+        if generator is None:
+            generator = PasswordGenerator(key,self.charset,self.mode,self.backend,self.sampler)
+        else:
+            generator.reseed(key)
+        generator.separate(domain)
+        local.generator = generator
+        local.epoch = epoch
+        return generator
+    def next_password(self,length,policy=None):
+        return self.generator().next_password(length,policy)
+    def next_passwords(self,count,length,policy=None):
+        return self.generator().next_passwords(count,length,policy)
+    def next_chars(self,n):
+        return self.generator().next_chars(n)
+    def next_bytes(self,n):
+        return self.generator().next_bytes(n)
+    def fill(self,buffer):
+        return self.generator().fill(buffer)
+    def reseed(self,key):
+        # replaces the key for every thread
+        # each thread reseeds its own generator the next time it is used
+        key = normalize_key(key)
+        with self.lock:
+            self.key = key
+            self.epoch += 1
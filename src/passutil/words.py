@@ -0,0 +1,185 @@
+# Copyright Aaron Stanek 2021
+# See LICENSE for more details
+
+import hashlib
+import math
+import mmap
+import os
+import re
+import struct
+import sys
+import tempfile
+from array import array
+from .pu import PasswordGenerator, check_length
+
+# a wordlist is a text file with one word per line
+# lines in the diceware format, "16655 abacus", hold the word after the digits
+# blank lines are skipped
+# the file is opened with mmap, and never read into a list
+# the offset index holds the start and end of each word
+# it is built once, and cached on disk, so that opening
+# a list of 100,000 words takes milliseconds
+
+# the index cache is kept in PASSUTIL_CACHE_DIR if it is set,
+# otherwise in $XDG_CACHE_HOME/passutil or ~/.cache/passutil
+
+# an index file starts with a header:
+# magic, then the size and mtime of the wordlist,
+# then the number of words, all native byte order
+# followed by the offsets, as native 8 byte integers
+INDEX_MAGIC = b'PUWORDS' + (b'<' if sys.byteorder == "little" else b'>')
+index_header = struct.Struct("=8sQQQ")
+
+# an optional run of digits, then the word, without trailing spaces
+word_pattern = re.compile(rb'^[ \t]*(?:[0-9]+[ \t]+)?(\S(?:[^\r\n]*\S)?)[ \t\r]*$',re.MULTILINE)
+
+def cache_dir():
+    path = os.environ.get("PASSUTIL_CACHE_DIR")
+    if path:
+        return path
+    base = os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"),".cache")
+    return os.path.join(base,"passutil")
+
+def index_path(path,directory):
+    # the name of the cached index of the wordlist at path
+    name = hashlib.sha256(os.path.abspath(path).encode("UTF-8")).hexdigest()[:32]
+    return os.path.join(directory,name + ".idx")
+
+def build_index(data):
+    # returns an array of offsets, the start and end of each word in data
+    offsets = array("Q")
+    for match in word_pattern.finditer(data):
+        offsets.append(match.start(1))
+        offsets.append(match.end(1))
+    return offsets
+
+def load_index(path,stat):
+    # returns the mmap of the cached index at path,
+    # or None if it is missing or out of date
+    try:
+        with open(path,"rb") as file:
+            if os.fstat(file.fileno()).st_size < index_header.size:
+                return None
+            data = mmap.mmap(file.fileno(),0,access=mmap.ACCESS_READ)
+    except OSError:
+        return None
+    magic, size, mtime, count = index_header.unpack_from(data)
+    if magic != INDEX_MAGIC or size != stat.st_size or mtime != stat.st_mtime_ns or len(data) != index_header.size + count * 16:
+        data.close()
+        return None
+    return data
+
+def save_index(path,stat,offsets):
+    # writes the index to path, replacing any older one
+    # failures are ignored, the index is only a cache
+    directory = os.path.dirname(path)
+    try:
+        os.makedirs(directory,exist_ok=True)
+        descriptor, temporary = tempfile.mkstemp(dir=directory,suffix=".tmp")
+        with os.fdopen(descriptor,"wb") as file:
+            file.write(index_header.pack(INDEX_MAGIC,stat.st_size,stat.st_mtime_ns,len(offsets)//2))
+            file.write(offsets.tobytes())
+        os.replace(temporary,path)
+    except OSError:
+        pass
+
+class Wordlist(object):
+    # a memory-mapped wordlist
+    # path is the path of the wordlist file
+    # cache is True to use the index cache, False to always
+    # build the index in memory, or the path of a cache directory
+    def __init__(self,path,cache=True):
+        self.path = os.fspath(path)
+        with open(self.path,"rb") as file:
+            stat = os.fstat(file.fileno())
+            if stat.st_size == 0:
+                raise ValueError("wordlist has no words")
+            self.data = mmap.mmap(file.fileno(),0,access=mmap.ACCESS_READ)
+        # offsets is a view of the cached index,
+        # or an array if the index had to be built
+        self.index_data = None
+        if cache is not False:
+            directory = cache_dir() if cache is True else os.fspath(cache)
+            cached = index_path(self.path,directory)
+            self.index_data = load_index(cached,stat)
+        if self.index_data is not None:
+            self.offsets = memoryview(self.index_data)[index_header.size:].cast("Q")
+        else:
+            self.offsets = build_index(self.data)
+            if cache is not False:
+                save_index(cached,stat,self.offsets)
+        if len(self.offsets) == 0:
+            # a file of blank lines is mapped by now
+            self.close()
+            raise ValueError("wordlist has no words")
+    def __len__(self):
+        return len(self.offsets) // 2
+    def __getitem__(self,index):
+        if index < 0:
+            index += len(self)
+        if index < 0 or index >= len(self):
+            raise IndexError("word index out of range")
+        return self.data[self.offsets[2*index]:self.offsets[2*index+1]].decode("UTF-8")
+    def __iter__(self):
+        for index in range(len(self)):
+            yield self[index]
+    def __enter__(self):
+        return self
+    def __exit__(self,exc_type,exc_value,traceback):
+        self.close()
+    def close(self):
+        # the view of the index is released before its mapping is closed
+        if self.index_data is not None:
+            self.offsets.release()
+            self.index_data.close()
+        self.data.close()
+
+def resolve_wordlist(wordlist):
+    # wordlist may be a Wordlist, or the path of a wordlist file
+    if isinstance(wordlist,Wordlist):
+        return wordlist
+    if isinstance(wordlist,(str,bytes,os.PathLike)):
+        return Wordlist(wordlist)
+    raise TypeError("wordlist parameter must be a Wordlist or a path")
+
+class PassphraseGenerator(object):
+    # generates passphrases of words drawn from a wordlist
+    # the word indices come from the same hash chain as passwords,
+    # see PasswordGenerator.next_indices
+    # key, mode, and backend are the same as in generate_password
+    # a Wordlist opened from a path is closed by close,
+    # one which was passed in is left to its owner
+    def __init__(self,key,wordlist,mode="standard",backend=None):
+        self.owns_wordlist = not isinstance(wordlist,Wordlist)
+        self.wordlist = resolve_wordlist(wordlist)
+        # the charset is never used, the generator only draws indices
+        self.generator = PasswordGenerator(key,"n",mode,backend,"index")
+    def next_passphrase(self,words,separator=" "):
+        # returns a passphrase of the given number of words
+        check_length(words,"words")
+        if type(separator) != str:
+            raise TypeError("separator parameter must be str")
+        wordlist = self.wordlist
+        return separator.join([wordlist[index] for index in self.generator.next_indices(words,len(wordlist))])
+    def next_passphrases(self,count,words,separator=" "):
+        check_length(count,"count")
+        return [self.next_passphrase(words,separator) for i in range(count)]
+    def entropy(self,words):
+        # the number of bits of entropy in a passphrase of the given number of words,
+        # if every word in the list is different
+        return words * math.log2(len(self.wordlist))
+    def __enter__(self):
+        return self
+    def __exit__(self,exc_type,exc_value,traceback):
+        self.close()
+    def close(self):
+        if self.owns_wordlist:
+            self.wordlist.close()
+
+def generate_passphrase(words,key,wordlist,separator=" ",mode="standard",backend=None):
+    with PassphraseGenerator(key,wordlist,mode,backend) as generator:
+        return generator.next_passphrase(words,separator)
+
+def generate_passphrases(count,words,key,wordlist,separator=" ",mode="standard",backend=None):
+    with PassphraseGenerator(key,wordlist,mode,backend) as generator:
+        return generator.next_passphrases(count,words,separator)
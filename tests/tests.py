@@ -3,9 +3,80 @@
 
 import unittest
 import sys
+import pickle
+import array
+import threading
+import asyncio
+import time
+import os
+import subprocess
+import socket
+import tempfile
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
 sys.path.append("../src")
 import passutil
 import passutil.chars as chars
+import passutil.pu as pu
+import passutil.entropy as entropy
+import passutil.bench as bench
+import passutil.stats as stats
+import passutil.policy as policy
+import passutil.server as server
+import passutil.client as client
+import passutil.testing as testing
+
+def run_cli(*args):
+    # runs python -m passutil with args
+    # returns (exit code, stdout bytes, stderr bytes)
+    env = dict(os.environ)
+    env["PYTHONPATH"] = os.path.abspath("../src")
+    result = subprocess.run([sys.executable,"-m","passutil"]+list(args),stdout=subprocess.PIPE,stderr=subprocess.PIPE,env=env)
+    return result.returncode, result.stdout, result.stderr
+
+def import_times(*args):
+    # runs python -X importtime with args
+    # returns a dict mapping each imported module
+    # to its cumulative import time in microseconds
+    env = dict(os.environ)
+    env["PYTHONPATH"] = os.path.abspath("../src")
+    result = subprocess.run([sys.executable,"-X","importtime"]+list(args),stdout=subprocess.PIPE,stderr=subprocess.PIPE,env=env)
+    times = {}
+    for line in result.stderr.decode("UTF-8").splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        fields = line.split("|")
+        times[fields[2].strip()] = int(fields[1])
+    return times
+
+def in_child(function):
+    # runs function in a forked child process,
+    # and returns the bytes it returned there
+    read, write = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        try:
+            os.close(read)
+            os.write(write,function())
+        finally:
+            os._exit(0)
+    os.close(write)
+    chunks = []
+    chunk = os.read(read,65536)
+    while chunk:
+        chunks.append(chunk)
+        chunk = os.read(read,65536)
+    os.close(read)
+    os.waitpid(pid,0)
+    return b''.join(chunks)
+
+def run_async(coroutine):
+    # runs coroutine on a new event loop
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(coroutine)
+    finally:
+        loop.close()
 
 class Test_character_ranges(unittest.TestCase):
     def test_types(self):
@@ -252,6 +323,240 @@ class Test_create_character_map(unittest.TestCase):
         self.assertEqual(is_none,18)
         self.assertTrue(all(map(lambda key: counts[key] == 7, counts)))
 
+class Test_Charset(unittest.TestCase):
+    def test_contents(self):
+        # a Charset should contain the same characters
+        # as the resolved valid_chars
+        for x in ["n","a","zre1234567890i$52e..i5",["a",66],(32,126),{"q"}]:
+            charset = passutil.Charset(x)
+            target = chars.normalize_valid_chars(x)
+            self.assertEqual(set(charset),target)
+            self.assertEqual(len(charset),len(target))
+            for codepoint in range(256):
+                self.assertEqual(codepoint in charset,codepoint in target)
+            self.assertEqual(chars.normalize_valid_chars(charset),target)
+    def test_table(self):
+        # the table should work like create_character_map
+        # with 0 in place of None
+        charset = passutil.Charset("uneE5")
+        self.assertEqual(type(charset.table),bytes)
+        self.assertEqual(len(charset.table),256)
+        self.assertEqual(charset.table.count(0),18)
+        self.assertEqual(len(charset.rejected),18)
+        for codepoint in charset:
+            self.assertEqual(charset.table.count(codepoint),7)
+    def test_pickle(self):
+        # charsets should survive being sent to another process
+        charset = passutil.Charset("zr")
+        self.assertEqual(pickle.loads(pickle.dumps(charset)),charset)
+    def test_immutable(self):
+        charset = passutil.Charset("n")
+        with self.assertRaises(AttributeError):
+            charset.mask = 0
+        with self.assertRaises(AttributeError):
+            charset.extra = 0
+    def test_equality(self):
+        # charsets with the same characters should be equal
+        self.assertEqual(passutil.Charset("h"),passutil.Charset("nia..ebcdf"))
+        self.assertEqual(hash(passutil.Charset("h")),hash(passutil.Charset("nia..ebcdf")))
+        self.assertNotEqual(passutil.Charset("h"),passutil.Charset("H"))
+    def test_cache(self):
+        # repeated charstrings should hit the cache
+        chars.charset_cache_clear()
+        first = passutil.compile_charset("zr")
+        second = passutil.compile_charset("zr")
+        self.assertTrue(first is second)
+        passutil.compile_charset(["a","b"])
+        passutil.compile_charset(("b","a"))
+        info = passutil.charset_cache_info()
+        self.assertEqual(info.hits,2)
+        self.assertEqual(info.misses,2)
+        # a Charset is returned as it is
+        self.assertTrue(passutil.compile_charset(first) is first)
+    def test_generate(self):
+        # a Charset should be accepted anywhere valid_chars is
+        charset = passutil.Charset("iAB")
+        self.assertEqual(set(passutil.generate_password(50,"hi",charset)),{"A","B"})
+        self.assertEqual(passutil.charset_size(charset),2)
+        self.assertEqual(passutil.rejection_rate(charset),0)
+    def test_safe_failure(self):
+        with self.assertRaises(Exception):
+            passutil.Charset("q")
+        with self.assertRaises(Exception):
+            passutil.compile_charset([{65}])
+        with self.assertRaises(Exception):
+            passutil.compile_charset(5)
+        # equal values of the wrong type should be rejected,
+        # even once the valid value is in the cache
+        passutil.compile_charset([33])
+        for element in [33.0,True]:
+            with self.assertRaises(TypeError):
+                passutil.compile_charset([element])
+        with self.assertRaises(Exception):
+            # a Charset may be empty, but not for generating passwords
+            passutil.generate_password(5,"hi",passutil.Charset(""))
+
+class Test_unicode(unittest.TestCase):
+    latin = [codepoint for codepoint in range(0xA1,0x100) if codepoint != 0xAD]
+    def test_validation(self):
+        # Unicode characters are only accepted when asked for
+        with self.assertRaises(ValueError):
+            passutil.Charset("i\u00e9")
+        with self.assertRaises(ValueError):
+            passutil.Charset(["\u00e9"])
+        self.assertEqual(len(passutil.Charset("ni\u00e9\u00e8e5",unicode=True)),11)
+        # but they must still be printable
+        for codepoint in [0x85,0xAD,0x200B,0xD800,0x110000,-1]:
+            with self.assertRaises(ValueError):
+                passutil.Charset([codepoint],unicode=True)
+    def test_charset(self):
+        charset = passutil.Charset(range(0x4E00,0x5E00),unicode=True)
+        self.assertEqual(len(charset),4096)
+        self.assertFalse(charset.ascii)
+        self.assertEqual(charset.table,None)
+        self.assertEqual(len(charset.symbols),4096)
+        self.assertEqual(list(charset),list(range(0x4E00,0x5E00)))
+        self.assertTrue("\u4e00" in charset)
+        self.assertFalse("\u5e00" in charset)
+        self.assertEqual(pickle.loads(pickle.dumps(charset)),charset)
+        # a Unicode charset of ASCII characters is the same as any other
+        ascii = passutil.Charset("iabc",unicode=True)
+        self.assertTrue(ascii.ascii)
+        self.assertEqual(ascii,passutil.Charset("iabc"))
+    def test_width(self):
+        # large charsets should get wider blocks, and still
+        # reject fewer than 1 in 128 of them
+        self.assertEqual(pu.sampler_width("standard",95),2)
+        self.assertEqual(pu.sampler_width("standard",5000),4)
+        self.assertEqual(pu.sampler_width("shake",5000),8)
+        for size in [257,1000,5000,65536,100000,1112064]:
+            sampler = chars.IndexSampler(set(range(size)),pu.sampler_width("standard",size))
+            self.assertTrue(sampler.rejection_rate < 1/128)
+    def test_generate(self):
+        for valid_chars in [self.latin,range(0x4E00,0x4E00+5000)]:
+            charset = passutil.Charset(valid_chars,unicode=True)
+            for mode in pu.modes:
+                result = passutil.generate_passwords(50,16,"hi",charset,mode=mode)
+                self.assertEqual(len(set(result)),50)
+                for password in result:
+                    self.assertEqual(len(password),16)
+                    self.assertTrue(set(password) <= set(charset.symbols))
+    def test_distribution(self):
+        charset = passutil.Charset("i\u00e9\u00e8\u00ea",unicode=True)
+        password = passutil.generate_password(30000,"hi",charset,mode="batched")
+        for character in charset.symbols:
+            self.assertTrue(abs(password.count(character)-10000) < 600)
+    def test_bytes(self):
+        # bytes are UTF-8 encoded
+        charset = passutil.Charset(self.latin,unicode=True)
+        generator = passutil.PasswordGenerator("hi",charset)
+        output = generator.next_bytes(10)
+        self.assertEqual(len(output),20)
+        self.assertEqual(len(output.decode("UTF-8")),10)
+        chunks = list(passutil.iter_password_chars("hi",charset,chunk_size=7,length=20))
+        self.assertEqual([len(chunk) for chunk in chunks],[7,7,6])
+        with self.assertRaises(ValueError):
+            generator.fill(bytearray(10))
+    def test_parallel(self):
+        charset = passutil.Charset(range(0x4E00,0x4E00+100),unicode=True)
+        result = passutil.generate_passwords_parallel(10,8,"hi",charset,workers=2)
+        self.assertEqual(len(result),10)
+        for password in result:
+            self.assertEqual(len(password),8)
+            self.assertTrue(set(password) <= set(charset.symbols))
+    @unittest.skipIf(chars.get_numpy() is None,"NumPy is not installed")
+    def test_numpy(self):
+        sampler = chars.IndexSampler(passutil.Charset(range(0x4E00,0x4E00+5000),unicode=True),8)
+        data = bytes(range(256))*300
+        outputs = []
+        for numpy in [True,False]:
+            chars.use_numpy = numpy
+            output = array.array(chars.CODEPOINT_TYPECODE)
+            sampler.sample(data,output,10000)
+            outputs.append(output)
+        chars.use_numpy = True
+        self.assertEqual(outputs[0],outputs[1])
+
+class Test_IndexSampler(unittest.TestCase):
+    def test_rejection(self):
+        # every charset size from 1 to 95 should
+        # have a rejection rate below 1%
+        for size in range(1,96):
+            valid_chars = set(range(32,32+size))
+            for width in [2,8]:
+                sampler = chars.IndexSampler(valid_chars,width)
+                self.assertTrue(sampler.digits >= 1)
+                self.assertTrue(sampler.rejection_rate < 0.01)
+                self.assertEqual(sampler.rejection_rate,chars.rejection_rate(valid_chars,width))
+    def test_uniform(self):
+        # feeding every possible block through the sampler
+        # should produce every character the same number of times
+        data = b''.join(value.to_bytes(2,"big") for value in range(65536))
+        for charstring in ["n","h","zr","a","iAB","iQ"]:
+            valid_chars = chars.resolve_charstring(charstring)
+            sampler = chars.IndexSampler(valid_chars,2)
+            output = bytearray()
+            sampler.sample(data,output,10**9)
+            counts = {}
+            for value in output:
+                counts[value] = counts.get(value,0) + 1
+            self.assertEqual(set(counts),valid_chars)
+            self.assertEqual(len(set(counts.values())),1)
+    def test_length(self):
+        # sample should stop when output reaches length
+        sampler = chars.IndexSampler(chars.resolve_charstring("n"),8)
+        output = bytearray(b'12')
+        sampler.sample(bytes(range(64)),output,5)
+        self.assertEqual(len(output),5)
+    def test_byte_rejection(self):
+        # width 1 is the character map
+        self.assertEqual(passutil.rejection_rate("a"),66/256)
+        self.assertEqual(passutil.rejection_rate("h"),0)
+        with self.assertRaises(Exception):
+            passutil.rejection_rate("")
+        with self.assertRaises(Exception):
+            passutil.rejection_rate("a",0)
+        with self.assertRaises(Exception):
+            # a single byte can't hold a digit
+            # with a low enough rejection rate
+            chars.IndexSampler(chars.resolve_charstring("a"),1)
+
+class Test_numpy(unittest.TestCase):
+    def tearDown(self):
+        chars.use_numpy = True
+    def sample(self,sampler,data,length,numpy):
+        chars.use_numpy = numpy
+        output = bytearray(b'xy')
+        sampler.sample(data,output,length)
+        return output
+    def test_fallback(self):
+        # with NumPy disabled, or not installed,
+        # large blocks should still be sampled
+        chars.use_numpy = False
+        sampler = chars.IndexSampler(chars.compile_charset("h"),8)
+        output = bytearray()
+        sampler.sample(bytes(range(256))*64,output,10000)
+        self.assertEqual(len(output),10000)
+        self.assertTrue(set(output) <= set(b'0123456789abcdef'))
+        self.assertEqual(len(passutil.generate_password(5000,"hi","z",mode="batched",sampler="index")),5000)
+    @unittest.skipIf(chars.get_numpy() is None,"NumPy is not installed")
+    def test_same_output(self):
+        # the vectorized path should append exactly the
+        # same characters as the Python loop
+        data = bytes(range(256))*300 + bytes(range(255,-1,-1))*300
+        for valid_chars in ["z","h","n","iabc","iA"]:
+            for width in [2,8]:
+                sampler = chars.IndexSampler(chars.compile_charset(valid_chars),width)
+                for length in [3,100,5000,10**6]:
+                    self.assertEqual(self.sample(sampler,data,length,True),self.sample(sampler,data,length,False))
+    @unittest.skipIf(chars.get_numpy() is None,"NumPy is not installed")
+    def test_generate(self):
+        result = passutil.generate_passwords(100,50,"hi","lni_",mode="batched",sampler="index")
+        self.assertEqual(len(set(result)),100)
+        for password in result:
+            self.assertEqual(len(password),50)
+            self.assertTrue(set(password) <= set("abcdefghijklmnopqrstuvwxyz0123456789_"))
+
 class Test_generate_password(unittest.TestCase):
     def test_1(self):
         # we should be able to create a password with length 0
@@ -321,6 +626,50 @@ class Test_generate_password(unittest.TestCase):
             else:
                 counts[char] = 1
         self.assertEqual(len(counts),93)
+    def test_high_yield(self):
+        # high_yield mode should produce passwords
+        # of the same form as standard mode
+        result = passutil.generate_password(5000,b'hi',"c",mode="high_yield")
+        self.assertEqual(type(result),str)
+        self.assertEqual(len(result),5000)
+        found = [False] * 26
+        for char in result:
+            number = ord(char)
+            self.assertTrue(number >= 65 and number <= 90)
+            found[number - 65] = True
+        self.assertTrue(all(found))
+        result = passutil.generate_password(0,"hi","iABC",mode="high_yield")
+        self.assertEqual(result,"")
+    def test_shake(self):
+        # shake mode should produce passwords
+        # of the same form as standard mode
+        result = passutil.generate_password(5000,b'hi',"ae5y",mode="shake")
+        self.assertEqual(type(result),str)
+        self.assertEqual(len(result),5000)
+        counts = {}
+        for char in result:
+            self.assertFalse(char == "5" or char == "y")
+            counts[char] = counts.get(char,0) + 1
+        self.assertEqual(len(counts),93)
+        result = passutil.generate_password(0,"hi","iABC",mode="shake")
+        self.assertEqual(result,"")
+        # a charset of size 1 has very few accepted bytes
+        result = passutil.generate_password(100,"hi","i!",mode="shake")
+        self.assertEqual(result,"!"*100)
+    def test_index(self):
+        # the index sampler should work in every mode
+        for mode in ["standard","high_yield","shake"]:
+            result = passutil.generate_password(3000,"hi","ae5y",mode=mode,sampler="index")
+            self.assertEqual(len(result),3000)
+            counts = {}
+            for char in result:
+                self.assertFalse(char == "5" or char == "y")
+                counts[char] = counts.get(char,0) + 1
+            self.assertEqual(len(counts),93)
+        generator = passutil.PasswordGenerator("hi","a",sampler="index")
+        self.assertTrue(generator.rejection_rate < 0.01)
+        generator = passutil.PasswordGenerator("hi","a")
+        self.assertEqual(generator.rejection_rate,66/256)
     def test_safe_failure(self):
         with self.assertRaises(Exception):
             # length should be an int
@@ -351,6 +700,1155 @@ class Test_generate_password(unittest.TestCase):
             # if charset is a list,
             # it may contain only str and int
             passutil.generate_password(0,"hi",[{65,66,67}])
+        with self.assertRaises(Exception):
+            # mode should be a known mode
+            passutil.generate_password(0,"hi","iABC",mode="fast")
+        with self.assertRaises(Exception):
+            # mode should be a str
+            passutil.generate_password(0,"hi","iABC",mode=1)
+        with self.assertRaises(Exception):
+            # sampler should be a known sampler
+            passutil.generate_password(0,"hi","iABC",sampler="wide")
+
+class Test_generate_passwords(unittest.TestCase):
+    def test_1(self):
+        # we should be able to create zero passwords
+        result = passutil.generate_passwords(0,10,"hi","iABC")
+        self.assertEqual(type(result),list)
+        self.assertEqual(len(result),0)
+    def test_2(self):
+        # we should get count passwords of the requested length
+        # containing only characters in the charset
+        result = passutil.generate_passwords(50,12,b'hi',"n")
+        self.assertEqual(type(result),list)
+        self.assertEqual(len(result),50)
+        for password in result:
+            self.assertEqual(type(password),str)
+            self.assertEqual(len(password),12)
+            for char in password:
+                self.assertTrue(char in "0123456789")
+        # with 10**12 possible passwords,
+        # we should not expect any duplicates
+        self.assertEqual(len(set(result)),50)
+    def test_3(self):
+        # we should be able to create passwords of length 0
+        result = passutil.generate_passwords(3,0,"hi",["a","b"])
+        self.assertEqual(result,["","",""])
+    def test_shake(self):
+        # shake mode should also work in bulk
+        result = passutil.generate_passwords(20,30,"hi","h",mode="shake")
+        self.assertEqual(len(result),20)
+        for password in result:
+            self.assertEqual(len(password),30)
+            for char in password:
+                self.assertTrue(char in "0123456789abcdef")
+    def test_batched(self):
+        # batched mode should also work in bulk
+        result = passutil.generate_passwords(200,10,"hi","a",mode="batched")
+        self.assertEqual(len(result),200)
+        self.assertEqual(len(set(result)),200)
+        for password in result:
+            self.assertEqual(len(password),10)
+        result = passutil.generate_passwords(20,10,"hi","a",mode="batched",sampler="index")
+        self.assertEqual(len(result),20)
+    def test_high_yield(self):
+        # high_yield mode should also work in bulk
+        result = passutil.generate_passwords(20,30,"hi","a",mode="high_yield")
+        self.assertEqual(len(result),20)
+        for password in result:
+            self.assertEqual(len(password),30)
+            for char in password:
+                self.assertTrue(ord(char) >= 32 and ord(char) <= 126)
+    def test_safe_failure(self):
+        with self.assertRaises(Exception):
+            # count should be an int
+            passutil.generate_passwords("1",10,"hi","iABC")
+        with self.assertRaises(Exception):
+            # count should be nonnegative
+            passutil.generate_passwords(-1,10,"hi","iABC")
+        with self.assertRaises(Exception):
+            # length should be nonnegative
+            passutil.generate_passwords(1,-10,"hi","iABC")
+        with self.assertRaises(Exception):
+            # key may not be empty
+            passutil.generate_passwords(1,10,"","iABC")
+        with self.assertRaises(Exception):
+            # charset may not be empty
+            passutil.generate_passwords(1,10,"hi","")
+
+class Test_generate_passwords_parallel(unittest.TestCase):
+    def test_1(self):
+        # we should get count distinct passwords of the requested length
+        result = passutil.generate_passwords_parallel(500,12,"hi","a",workers=2,chunk_size=64)
+        self.assertEqual(type(result),list)
+        self.assertEqual(len(result),500)
+        for password in result:
+            self.assertEqual(type(password),str)
+            self.assertEqual(len(password),12)
+        self.assertEqual(len(set(result)),500)
+    def test_chunks(self):
+        # the chunks should be streamed back in order,
+        # with at most chunk_size passwords in each
+        chunks = list(passutil.iter_passwords_parallel(25,4,b'hi',"n",workers=2,chunk_size=10,mode="shake"))
+        self.assertEqual([len(chunk) for chunk in chunks],[10,10,5])
+    def test_empty(self):
+        # zero passwords, or passwords of length zero, should work
+        self.assertEqual(passutil.generate_passwords_parallel(0,10,"hi","n",workers=1),[])
+        self.assertEqual(passutil.generate_passwords_parallel(3,0,"hi","n",workers=1),["","",""])
+    def test_custom_backend(self):
+        # a backend which isn't in hash_backends should reach the workers
+        backend = pu.HashBackend("custom",hashlib.sha512,False)
+        result = passutil.generate_passwords_parallel(20,8,"hi","n",workers=2,backend=backend)
+        self.assertEqual(len(set(result)),20)
+        # and one which can't be sent to them should fail up front
+        backend = pu.HashBackend("local",lambda data=b'': hashlib.sha512(data),False)
+        with self.assertRaises(TypeError):
+            passutil.generate_passwords_parallel(20,8,"hi","n",workers=2,backend=backend)
+    def test_safe_failure(self):
+        with self.assertRaises(Exception):
+            # workers should be positive
+            passutil.generate_passwords_parallel(10,10,"hi","n",workers=0)
+        with self.assertRaises(Exception):
+            # chunk_size should be positive
+            passutil.generate_passwords_parallel(10,10,"hi","n",chunk_size=0)
+        with self.assertRaises(Exception):
+            # charset may not be empty
+            passutil.generate_passwords_parallel(10,10,"hi","",workers=1)
+        with self.assertRaises(Exception):
+            # key may not be empty
+            passutil.generate_passwords_parallel(10,10,"","n",workers=1)
+
+class Test_PasswordGenerator(unittest.TestCase):
+    def test_next_chars(self):
+        # next_chars should continue the hash chain
+        generator = passutil.PasswordGenerator("hi","n")
+        for length in [0,1,10,100]:
+            result = generator.next_chars(length)
+            self.assertEqual(type(result),str)
+            self.assertEqual(len(result),length)
+            for char in result:
+                self.assertTrue(char in "0123456789")
+    def test_next_password(self):
+        # next_password should give distinct passwords
+        for mode in ["standard","high_yield","shake"]:
+            generator = passutil.PasswordGenerator(b'hi',"a",mode=mode)
+            result = [generator.next_password(16) for i in range(20)]
+            self.assertEqual(len(set(result)),20)
+            for password in result:
+                self.assertEqual(len(password),16)
+    def test_separate(self):
+        # separating should change the state
+        generator = passutil.PasswordGenerator("hi","n")
+        garbage = generator.garbage
+        generator.separate(b'domain')
+        self.assertNotEqual(garbage,generator.garbage)
+    def test_reseed(self):
+        # reseeding should change the key
+        # but keep the generator usable
+        generator = passutil.PasswordGenerator("hi","n",backend="blake2b")
+        garbage = generator.garbage
+        generator.reseed("there")
+        self.assertNotEqual(garbage,generator.garbage)
+        self.assertEqual(len(generator.next_password(8)),8)
+    def test_slots(self):
+        # the generator should not have a __dict__
+        generator = passutil.PasswordGenerator("hi","n")
+        with self.assertRaises(AttributeError):
+            generator.extra = 5
+    def test_safe_failure(self):
+        with self.assertRaises(Exception):
+            # key may not be empty
+            passutil.PasswordGenerator("","n")
+        with self.assertRaises(Exception):
+            # charset may not be empty
+            passutil.PasswordGenerator("hi","")
+        with self.assertRaises(Exception):
+            # mode should be a known mode
+            passutil.PasswordGenerator("hi","n",mode="fast")
+        generator = passutil.PasswordGenerator("hi","n")
+        with self.assertRaises(Exception):
+            # length should be nonnegative
+            generator.next_password(-1)
+        with self.assertRaises(Exception):
+            # n should be an int
+            generator.next_chars("5")
+        with self.assertRaises(Exception):
+            # key may not be empty
+            generator.reseed(b'')
+
+class Test_ThreadSafeGenerator(unittest.TestCase):
+    def test_default_mode(self):
+        # shake is the fastest mode for single passwords
+        self.assertEqual(passutil.ThreadSafeGenerator("hi","a").mode,"shake")
+        with passutil.PasswordPool("hi",size=5) as pool:
+            self.assertEqual(pool.mode,"shake")
+    def test_threads(self):
+        # many threads sharing one generator should get
+        # distinct passwords, each from their own PasswordGenerator
+        generator = passutil.ThreadSafeGenerator("hi","a")
+        def work(i):
+            return generator.next_passwords(50,16), id(generator.generator())
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            results = list(executor.map(work,range(16)))
+        passwords = [password for batch, ident in results for password in batch]
+        self.assertEqual(len(passwords),800)
+        self.assertEqual(len(set(passwords)),800)
+        for password in passwords:
+            self.assertEqual(len(password),16)
+    def test_per_thread(self):
+        # different threads should not share a PasswordGenerator
+        generator = passutil.ThreadSafeGenerator("hi","n",mode="standard")
+        found = []
+        thread = threading.Thread(target=lambda: found.append(generator.generator()))
+        thread.start()
+        thread.join()
+        self.assertFalse(found[0] is generator.generator())
+        self.assertTrue(generator.generator() is generator.generator())
+    def test_reseed(self):
+        # reseeding should reach the generator of every thread
+        generator = passutil.ThreadSafeGenerator("hi","n")
+        before = generator.generator()
+        garbage = before.garbage
+        generator.reseed("there")
+        after = generator.generator()
+        self.assertTrue(before is after)
+        self.assertNotEqual(garbage,after.garbage)
+        self.assertEqual(len(generator.next_chars(20)),20)
+        buffer = bytearray(10)
+        self.assertEqual(generator.fill(buffer),10)
+    def test_safe_failure(self):
+        with self.assertRaises(Exception):
+            # charset may not be empty
+            passutil.ThreadSafeGenerator("hi","")
+        with self.assertRaises(Exception):
+            # mode should be a known mode
+            passutil.ThreadSafeGenerator("hi","n",mode="fast")
+        with self.assertRaises(Exception):
+            # key may not be empty
+            passutil.ThreadSafeGenerator("hi","n").reseed("")
+
+class Test_PasswordPool(unittest.TestCase):
+    def wait_for(self,condition):
+        # waits up to 10 seconds for the background thread
+        deadline = time.time() + 10
+        while not condition():
+            self.assertTrue(time.time() < deadline)
+            time.sleep(0.01)
+    def test_get(self):
+        # passwords should have the requested form,
+        # and never repeat
+        with passutil.PasswordPool("hi",size=50) as pool:
+            result = [pool.get(12,"a") for i in range(200)]
+            self.assertEqual(len(set(result)),200)
+            for password in result:
+                self.assertEqual(len(password),12)
+            self.assertEqual(set(pool.get(20,"n")) <= set("0123456789"),True)
+            stats = pool.stats()
+            self.assertEqual(stats["hits"] + stats["misses"],201)
+    def test_refill(self):
+        # falling below the low watermark should trigger a refill
+        with passutil.PasswordPool("hi",size=20,low_watermark=10) as pool:
+            pool.prefill(8,"h")
+            self.assertEqual(pool.fill_level(8,"h"),20)
+            for i in range(11):
+                pool.get(8,"h")
+            self.wait_for(lambda: pool.fill_level(8,"h") == 20)
+            stats = pool.stats()
+            self.assertEqual(stats["hits"],11)
+            self.assertTrue(stats["refills"] >= 2)
+            self.assertTrue(stats["last_refill_seconds"] > 0)
+            self.assertEqual(stats["fill"][(8,"0123456789abcdef")],20)
+    def test_charset_buckets(self):
+        # equivalent charsets should share a bucket
+        with passutil.PasswordPool("hi",size=5) as pool:
+            pool.prefill(4,"h")
+            self.assertEqual(pool.fill_level(4,"nia..ebcdf"),5)
+            self.assertEqual(pool.fill_level(5,"h"),0)
+    def test_concurrent_refill(self):
+        # refills racing on one bucket should never overfill it,
+        # and threads racing to make a bucket should share one
+        with passutil.PasswordPool("hi",size=5000) as pool:
+            barrier = threading.Barrier(16)
+            def prefill():
+                barrier.wait()
+                pool.prefill(16,"z")
+            def get():
+                barrier.wait()
+                pool.get(24,"z")
+            threads = [threading.Thread(target=prefill) for i in range(8)]
+            threads += [threading.Thread(target=get) for i in range(8)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            self.assertEqual(pool.fill_level(16,"z"),5000)
+            self.assertEqual(len(pool.buckets),2)
+            # the gets after the first refill each take one password
+            self.wait_for(lambda: pool.fill_level(24,"z") >= 4992)
+            time.sleep(0.1)
+            self.assertEqual(pool.fill_level(16,"z"),5000)
+            self.assertTrue(pool.fill_level(24,"z") <= 5000)
+    @unittest.skipUnless(hasattr(os,"fork"),"needs os.fork")
+    def test_fork(self):
+        # a forked child should never hand out the passwords
+        # which were ready in its parent
+        with passutil.PasswordPool("hi",size=20) as pool:
+            pool.prefill(12,"z")
+            def child():
+                passwords = [pool.get(12,"z") for i in range(30)]
+                pool.prefill(8,"n")
+                return "\n".join(passwords + [str(pool.fill_level(8,"n"))]).encode("UTF-8")
+            result = in_child(child).decode("UTF-8").split("\n")
+            self.assertEqual(len(result),31)
+            self.assertEqual(result[-1],"20")
+            passwords = [pool.get(12,"z") for i in range(30)]
+            self.assertEqual(len(set(passwords+result[:-1])),60)
+            self.assertEqual(pool.fill_level(8,"n"),0)
+    def test_wipe(self):
+        # closing the pool should wipe the passwords that are left
+        pool = passutil.PasswordPool("hi",size=5)
+        pool.prefill(6,"iA")
+        entries = list(pool.buckets.values())[0].entries
+        kept = list(entries)
+        self.assertEqual(bytes(kept[0]),b'AAAAAA')
+        pool.close()
+        for entry in kept:
+            self.assertEqual(bytes(entry),b'\x00'*6)
+        with self.assertRaises(Exception):
+            pool.get(6,"iA")
+    def test_safe_failure(self):
+        with self.assertRaises(Exception):
+            passutil.PasswordPool("hi",size=0)
+        with self.assertRaises(Exception):
+            passutil.PasswordPool("hi",size=5,low_watermark=6)
+        with self.assertRaises(Exception):
+            passutil.PasswordPool("",size=5)
+        with passutil.PasswordPool("hi",size=5) as pool:
+            with self.assertRaises(Exception):
+                pool.get(-1,"n")
+            with self.assertRaises(Exception):
+                pool.get(5,"")
+
+class Test_aio(unittest.TestCase):
+    def test_agenerate_password(self):
+        result = run_async(passutil.agenerate_password(200000,"hi","n",mode="shake"))
+        self.assertEqual(type(result),str)
+        self.assertEqual(len(result),200000)
+        self.assertTrue(set(result) <= set("0123456789"))
+        self.assertEqual(run_async(passutil.agenerate_password(0,"hi","n")),"")
+    def test_agenerate_passwords(self):
+        result = run_async(passutil.agenerate_passwords(30,12,"hi","a"))
+        self.assertEqual(len(result),30)
+        self.assertEqual(len(set(result)),30)
+        for password in result:
+            self.assertEqual(len(password),12)
+    def test_aiter_passwords(self):
+        # an unbounded iterator should only produce what is consumed
+        async def take(n):
+            output = []
+            async for password in passutil.aiter_passwords(None,8,"hi","h"):
+                output.append(password)
+                if len(output) == n:
+                    break
+            return output
+        result = run_async(take(5))
+        self.assertEqual(len(result),5)
+    def test_aiter_password_chars(self):
+        async def collect():
+            return [chunk async for chunk in passutil.aiter_password_chars("hi","n",chunk_size=7,length=30)]
+        chunks = run_async(collect())
+        self.assertEqual([len(chunk) for chunk in chunks],[7,7,7,7,2])
+    def test_cancel(self):
+        # cancelling should stop the work between batches
+        async def cancel():
+            task = asyncio.ensure_future(passutil.agenerate_password(10**9,"hi","n"))
+            await asyncio.sleep(0.05)
+            task.cancel()
+            await task
+        with self.assertRaises(asyncio.CancelledError):
+            run_async(cancel())
+    def test_safe_failure(self):
+        with self.assertRaises(Exception):
+            run_async(passutil.agenerate_password(-1,"hi","n"))
+        with self.assertRaises(Exception):
+            run_async(passutil.agenerate_password(10,"hi",""))
+        with self.assertRaises(Exception):
+            run_async(passutil.agenerate_passwords(-1,10,"hi","n"))
+
+class Test_iter_password_chars(unittest.TestCase):
+    def test_length(self):
+        # the chunks should add up to the requested length
+        chunks = list(passutil.iter_password_chars("hi","n",chunk_size=7,length=30))
+        self.assertEqual([len(chunk) for chunk in chunks],[7,7,7,7,2])
+        for chunk in chunks:
+            self.assertEqual(type(chunk),str)
+            for char in chunk:
+                self.assertTrue(char in "0123456789")
+    def test_binary(self):
+        # binary chunks should be ascii encoded bytes
+        chunks = list(passutil.iter_password_chars("hi","iAB",chunk_size=100,length=100,binary=True))
+        self.assertEqual(len(chunks),1)
+        self.assertEqual(type(chunks[0]),bytes)
+        self.assertEqual(set(chunks[0]),{65,66})
+    def test_unbounded(self):
+        # without a length, the stream should not end
+        stream = passutil.iter_password_chars("hi","a",chunk_size=1000,mode="shake")
+        for i in range(20):
+            self.assertEqual(len(next(stream)),1000)
+    def test_safe_failure(self):
+        with self.assertRaises(Exception):
+            # chunk_size should be positive
+            next(passutil.iter_password_chars("hi","n",chunk_size=0))
+        with self.assertRaises(Exception):
+            # length should be nonnegative
+            next(passutil.iter_password_chars("hi","n",length=-1))
+
+class Test_generate_password_into(unittest.TestCase):
+    def test_bytearray(self):
+        # the buffer should be filled in place
+        buffer = bytearray(100000)
+        result = passutil.generate_password_into(buffer,"hi","h",mode="shake")
+        self.assertEqual(result,100000)
+        self.assertTrue(set(buffer) <= set(b'0123456789abcdef'))
+    def test_memoryview(self):
+        # a slice of a memoryview should be filled,
+        # leaving the rest of the buffer alone
+        buffer = bytearray(20)
+        passutil.generate_password_into(memoryview(buffer)[5:15],"hi","iA")
+        self.assertEqual(bytes(buffer),b'\x00'*5 + b'A'*10 + b'\x00'*5)
+    def test_safe_failure(self):
+        with self.assertRaises(Exception):
+            # the buffer should be writable
+            passutil.generate_password_into(b'12345',"hi","n")
+
+class Test_passphrase(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.cache = os.path.join(self.directory.name,"cache")
+        self.path = os.path.join(self.directory.name,"words.txt")
+        # wordlists opened with the default cache should not
+        # write to the real cache directory
+        self.environ = dict(os.environ)
+        os.environ["PASSUTIL_CACHE_DIR"] = self.cache
+        # diceware lines, plain lines, blank lines, and stray spaces
+        with open(self.path,"w",newline="") as file:
+            for index in range(7776):
+                file.write("{:05d}\tword{}\n".format(index,index))
+            file.write("\n  plain  \r\n\u00e9t\u00e9\n12345\n")
+    def tearDown(self):
+        os.environ.clear()
+        os.environ.update(self.environ)
+        self.directory.cleanup()
+    def test_wordlist(self):
+        with passutil.Wordlist(self.path,cache=self.cache) as wordlist:
+            self.assertEqual(len(wordlist),7779)
+            self.assertEqual(wordlist[0],"word0")
+            self.assertEqual(wordlist[7775],"word7775")
+            self.assertEqual(list(wordlist)[-3:],["plain","\u00e9t\u00e9","12345"])
+            self.assertEqual(wordlist[-1],"12345")
+            with self.assertRaises(IndexError):
+                wordlist[7779]
+    def test_cache(self):
+        # the index should be built once, then loaded from disk
+        first = passutil.Wordlist(self.path,cache=self.cache)
+        self.assertEqual(type(first.offsets),array.array)
+        self.assertEqual(len(os.listdir(self.cache)),1)
+        second = passutil.Wordlist(self.path,cache=self.cache)
+        self.assertEqual(type(second.offsets),memoryview)
+        self.assertEqual(list(first),list(second))
+        first.close()
+        second.close()
+        # a changed wordlist should not use the old index
+        with open(self.path,"a") as file:
+            file.write("extra\n")
+        with passutil.Wordlist(self.path,cache=self.cache) as third:
+            self.assertEqual(type(third.offsets),array.array)
+            self.assertEqual(third[-1],"extra")
+        # without a cache, nothing is written
+        with passutil.Wordlist(self.path,cache=False) as fourth:
+            self.assertEqual(len(fourth),7780)
+    def test_generate(self):
+        wordlist = passutil.Wordlist(self.path,cache=self.cache)
+        words = set(wordlist)
+        for mode in pu.modes:
+            generator = passutil.PassphraseGenerator("hi",wordlist,mode=mode)
+            result = generator.next_passphrases(20,6)
+            self.assertEqual(len(set(result)),20)
+            for passphrase in result:
+                self.assertEqual(len(passphrase.split(" ")),6)
+                self.assertTrue(set(passphrase.split(" ")) <= words)
+        passphrase = passutil.generate_passphrase(4,"hi",self.path,separator="-")
+        self.assertEqual(len(passphrase.split("-")),4)
+        self.assertEqual(passutil.generate_passphrases(3,0,"hi",wordlist),["","",""])
+        self.assertAlmostEqual(passutil.PassphraseGenerator("hi",wordlist).entropy(6),6*12.925,places=2)
+        # a Wordlist which was passed in is left open
+        with passutil.PassphraseGenerator("hi",wordlist) as generator:
+            generator.next_passphrase(2)
+        self.assertFalse(wordlist.data.closed)
+        wordlist.close()
+        # one opened from a path is closed
+        with passutil.PassphraseGenerator("hi",self.path) as generator:
+            generator.next_passphrase(2)
+        self.assertTrue(generator.wordlist.data.closed)
+    def test_indices(self):
+        # word indices should be uniformly distributed
+        generator = passutil.PasswordGenerator("hi","n")
+        indices = generator.next_indices(70000,7)
+        for index in range(7):
+            self.assertTrue(abs(indices.count(index)-10000) < 500)
+        self.assertEqual(list(generator.next_indices(3,1)),[0,0,0])
+        with self.assertRaises(ValueError):
+            generator.next_indices(3,0)
+    def test_safe_failure(self):
+        empty = os.path.join(self.directory.name,"empty.txt")
+        with open(empty,"w") as file:
+            file.write("\n\n")
+        # the maps of a wordlist with no words should be closed,
+        # both when its index is built and when it is loaded
+        opened = []
+        class Recorded(passutil.Wordlist):
+            def close(self):
+                opened.append(self)
+                passutil.Wordlist.close(self)
+        for i in range(2):
+            with self.assertRaises(ValueError):
+                Recorded(empty,cache=self.cache)
+        self.assertEqual(len(opened),2)
+        self.assertTrue(opened[0].data.closed)
+        self.assertTrue(opened[1].data.closed)
+        self.assertTrue(opened[1].index_data.closed)
+        with self.assertRaises(Exception):
+            passutil.Wordlist(os.path.join(self.directory.name,"missing.txt"))
+        with self.assertRaises(TypeError):
+            passutil.generate_passphrase(4,"hi",5)
+        with self.assertRaises(TypeError):
+            passutil.generate_passphrase(4,"hi",self.path,separator=5)
+    def test_command_line(self):
+        code, out, err = run_cli("--count","3","--separator","-","--words",self.path,"5")
+        self.assertEqual(code,0)
+        lines = out.decode("UTF-8").split()
+        self.assertEqual(len(lines),3)
+        for line in lines:
+            self.assertEqual(len(line.split("-")),5)
+
+class Test_policy(unittest.TestCase):
+    def brute_force(self,alphabet,length,check):
+        # every password of the given length which passes check
+        passwords = [""]
+        for index in range(length):
+            passwords = [password+char for password in passwords for char in alphabet]
+        return sorted(filter(check,passwords))
+    def test_count(self):
+        # the counts and the passwords they index should match
+        # a brute force enumeration of the compliant passwords
+        rules = passutil.Policy({"n":1,"u":1},max_run=2)
+        def check(password):
+            return (any(char.isdigit() for char in password) and any(char.isupper() for char in password)
+                and all(not password[i] == password[i+1] == password[i+2] for i in range(len(password)-2)))
+        sampler = policy.compile_policy(rules,passutil.Charset(list("AB01a")))
+        for length in range(6):
+            expected = self.brute_force("AB01a",length,check)
+            self.assertEqual(sampler.count(length),len(expected))
+            self.assertEqual(rules.count(length,list("AB01a")),len(expected))
+            produced = sorted(sampler.unrank(index,length).tobytes().decode("UTF-32-LE") for index in range(len(expected)))
+            self.assertEqual(produced,expected)
+    def test_generate(self):
+        rules = passutil.Policy({"u":2,"n":2,"p":1},max_run=1,exclude_ambiguous=True)
+        passwords = passutil.generate_passwords(200,10,"hi","z",policy=rules)
+        self.assertEqual(len(set(passwords)),200)
+        for password in passwords:
+            self.assertEqual(len(password),10)
+            self.assertTrue(sum(char.isupper() for char in password) >= 2)
+            self.assertTrue(sum(char.isdigit() for char in password) >= 2)
+            self.assertTrue(sum(ord(char) in chars.character_ranges["p"] for char in password) >= 1)
+            self.assertTrue(all(password[i] != password[i+1] for i in range(9)))
+            self.assertFalse(set(password) & set(passutil.AMBIGUOUS_CHARS))
+        for mode in pu.modes:
+            password = passutil.generate_password(20,"hi","h",mode=mode,policy=passutil.Policy({"n":18}))
+            self.assertTrue(sum(char.isdigit() for char in password) >= 18)
+        generator = passutil.ThreadSafeGenerator("hi","z")
+        self.assertEqual(len(generator.next_passwords(3,8,passutil.Policy({"l":8}))),3)
+        unicode = passutil.Charset(range(0x4E00,0x4E10),unicode=True)
+        password = passutil.generate_password(8,"hi",unicode,policy=passutil.Policy(max_run=1,exclude="\u4E00"))
+        self.assertFalse("\u4E00" in password)
+    def test_uniform(self):
+        # every compliant password should be equally likely
+        rules = passutil.Policy({"n":1,"u":1},max_run=1)
+        counts = {}
+        for password in passutil.generate_passwords(24000,3,"hi",list("AB01"),policy=rules):
+            counts[password] = counts.get(password,0) + 1
+        # 32 passwords, each expected 750 times
+        self.assertEqual(len(counts),rules.count(3,list("AB01")))
+        self.assertEqual(len(counts),32)
+        for count in counts.values():
+            self.assertTrue(abs(count-750) < 150)
+    def test_cost(self):
+        rules = passutil.Policy({"n":1})
+        cost = rules.cost(2,"h")
+        self.assertEqual(cost["compliant"],16*16-6*6)
+        self.assertEqual(cost["total"],256)
+        self.assertAlmostEqual(cost["retry_attempts"],256/220)
+        self.assertEqual(cost["random_bytes"],12)
+        self.assertEqual(passutil.Policy({"n":3}).cost(2,"h")["compliant"],0)
+        self.assertEqual(cost["table_states"],2)
+        self.assertEqual(cost["table_operations"],2*2*2)
+        self.assertRaises(ValueError,rules.cost,2,"h","fast")
+        # the time stamp is taken once for each hash call
+        rules = passutil.Policy({"u":3,"l":3,"n":3,"p":3},max_run=3)
+        for mode in pu.modes:
+            source = testing.DeterministicSource(mode)
+            generator = passutil.PasswordGenerator("hi","z",mode=mode,source=source)
+            ticks = source.ticks
+            generator.next_password(40,rules)
+            self.assertEqual(source.ticks-ticks,rules.cost(40,"z",mode)["hash_calls"])
+    def test_equality(self):
+        first = passutil.Policy({"n":1,"u":0},max_run=2,exclude="ab")
+        second = passutil.Policy({"n":1},max_run=2,exclude="ba")
+        self.assertEqual(first,second)
+        self.assertEqual(hash(first),hash(second))
+        self.assertEqual(pickle.loads(pickle.dumps(first)),first)
+        self.assertNotEqual(first,passutil.Policy({"n":1}))
+        with self.assertRaises(AttributeError):
+            first.max_run = 3
+    def test_safe_failure(self):
+        with self.assertRaises(ValueError):
+            passutil.Policy({"x":1})
+        with self.assertRaises(ValueError):
+            passutil.Policy({"n":-1})
+        with self.assertRaises(TypeError):
+            passutil.Policy({"n":"1"})
+        with self.assertRaises(TypeError):
+            passutil.Policy(["n"])
+        with self.assertRaises(ValueError):
+            passutil.Policy(max_run=0)
+        with self.assertRaises(TypeError):
+            passutil.Policy(exclude=5)
+        with self.assertRaises(ValueError):
+            # no password of length 2 has three numerals
+            passutil.generate_password(2,"hi","h",policy=passutil.Policy({"n":3}))
+        with self.assertRaises(ValueError):
+            # the only characters are excluded
+            passutil.generate_password(2,"hi","n",policy=passutil.Policy(exclude="0123456789"))
+        with self.assertRaises(ValueError):
+            passutil.generate_password(policy.POLICY_MAX_LENGTH+1,"hi","n",policy=passutil.Policy())
+        with self.assertRaises(TypeError):
+            passutil.generate_password(2,"hi","n",policy="n")
+
+class Test_server(unittest.TestCase):
+    def setUp(self):
+        # the server runs on an event loop in a background thread
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name,"passutil.sock")
+        self.loop = asyncio.new_event_loop()
+        self.server = self.loop.run_until_complete(passutil.start_server("hi",self.path))
+        self.thread = threading.Thread(target=self.loop.run_forever)
+        self.thread.start()
+    def tearDown(self):
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+        self.server.close()
+        self.loop.run_until_complete(self.server.wait_closed())
+        self.loop.close()
+        self.directory.cleanup()
+    def test_request(self):
+        passwords = passutil.request_passwords(20,12,"h",path=self.path)
+        self.assertEqual(len(set(passwords)),20)
+        for password in passwords:
+            self.assertEqual(len(password),12)
+            self.assertTrue(set(password) <= set("0123456789abcdef"))
+        self.assertEqual(len(passutil.request_password(16,"a",key="more key",path=self.path)),16)
+        self.assertEqual(passutil.request_passwords(0,8,"z",path=self.path),[])
+        self.assertEqual(passutil.request_passwords(3,0,"z",path=self.path),["","",""])
+        # many batches in one response
+        self.assertEqual(len(passutil.request_passwords(20000,16,"z",path=self.path)),20000)
+    def test_concurrent(self):
+        def request(index):
+            return passutil.request_passwords(50,10,"zn",path=self.path)
+        with ThreadPoolExecutor(max_workers=16) as executor:
+            batches = list(executor.map(request,range(64)))
+        self.assertEqual(len({password for batch in batches for password in batch}),64*50)
+    def test_permissions(self):
+        self.assertEqual(os.stat(self.path).st_mode & 0o777,0o600)
+    def test_safe_failure(self):
+        with self.assertRaises(ValueError):
+            passutil.request_password(8,"q",path=self.path)
+        with self.assertRaises(ValueError):
+            passutil.request_password(-1,"z",path=self.path)
+        with self.assertRaises(ValueError):
+            passutil.request_passwords(server.SERVER_MAX_COUNT+1,8,"z",path=self.path)
+        with self.assertRaises(ValueError):
+            passutil.request_password(server.SERVER_MAX_LENGTH+1,"z",path=self.path)
+        with self.assertRaises(ValueError):
+            # whitespace would split the request
+            passutil.request_password(8,"nia b",path=self.path)
+        with self.assertRaises(ValueError):
+            passutil.request_password(8,"z",path=os.path.join(self.directory.name,"missing.sock"))
+        with self.assertRaises(ValueError):
+            # a server is already listening
+            run_async(passutil.start_server("hi",self.path))
+        # a socket left behind by a stopped server is replaced
+        stale = os.path.join(self.directory.name,"stale.sock")
+        probe = socket.socket(socket.AF_UNIX,socket.SOCK_STREAM)
+        probe.bind(stale)
+        probe.close()
+        server.remove_stale_socket(stale)
+        self.assertFalse(os.path.exists(stale))
+    def test_ownership(self):
+        # a server run by another user should not be trusted
+        getuid = os.getuid
+        os.getuid = lambda: getuid() + 1
+        try:
+            with self.assertRaises(ValueError):
+                passutil.request_password(8,"z",path=self.path)
+        finally:
+            os.getuid = getuid
+    def test_default_path(self):
+        environ = dict(os.environ)
+        for name in ("PASSUTIL_SOCKET","XDG_RUNTIME_DIR"):
+            os.environ.pop(name,None)
+        os.environ["TMPDIR"] = self.directory.name
+        try:
+            path = client.default_socket_path(create=True)
+            directory = os.path.dirname(path)
+            self.assertEqual(os.stat(directory).st_mode & 0o777,0o700)
+            self.assertEqual(client.default_socket_path(),path)
+            # a directory which others may use is refused
+            os.chmod(directory,0o755)
+            with self.assertRaises(ValueError):
+                client.default_socket_path()
+        finally:
+            os.environ.clear()
+            os.environ.update(environ)
+    def test_command_line(self):
+        code, out, err = run_cli("--socket",self.path,"--count","3","h","10")
+        self.assertEqual(code,0)
+        self.assertEqual(len(out.split()),3)
+        code, out, err = run_cli("--socket",self.path,"q","10")
+        self.assertEqual(code,1)
+        self.assertTrue(len(err) > 0)
+
+class Test_source(unittest.TestCase):
+    def test_deterministic(self):
+        # the same seed should give the same passwords
+        for mode in pu.modes:
+            for sampler in pu.samplers:
+                first = passutil.generate_passwords(5,20,"hi","z",mode=mode,sampler=sampler,source=testing.DeterministicSource(b'seed'))
+                second = passutil.generate_passwords(5,20,"hi","z",mode=mode,sampler=sampler,source=testing.DeterministicSource("seed"))
+                third = passutil.generate_passwords(5,20,"hi","z",mode=mode,sampler=sampler,source=testing.DeterministicSource(b'other'))
+                self.assertEqual(first,second)
+                self.assertNotEqual(first,third)
+        rules = passutil.Policy({"n":2})
+        self.assertEqual(
+            passutil.generate_password(12,"hi","z",policy=rules,source=testing.DeterministicSource(b'seed')),
+            passutil.generate_password(12,"hi","z",policy=rules,source=testing.DeterministicSource(b'seed')))
+    def test_known_answers(self):
+        # these only change if the way passwords are generated changes
+        self.assertEqual(passutil.generate_password(16,"key","z",source=testing.DeterministicSource(b'seed')),">*qPdJSMhu?;YqZ+")
+        self.assertEqual(passutil.generate_password(16,"key","z",mode="shake",source=testing.DeterministicSource(b'seed')),"8OG-v)N_L,U[/u>j")
+        self.assertEqual(passutil.generate_password(16,"key","z",mode="high_yield",sampler="index",source=testing.DeterministicSource(b'seed')),",HA_5ZN:OK+zZ@i`")
+        self.assertEqual(passutil.generate_passwords(3,10,"key","h",source=testing.DeterministicSource(b'x')),["21f3e901d0","eada006ee6","35c636627c"])
+    def test_components(self):
+        source = testing.DeterministicSource(b'seed')
+        self.assertEqual(source.random_bytes(16),testing.DeterministicSource(b'seed').random_bytes(16))
+        self.assertNotEqual(source.random_bytes(16),source.random_bytes(16))
+        self.assertEqual(source.time_stamp(),entropy.pack_time(1,1))
+        self.assertEqual(
+            pu.UniqueCounter(source=testing.DeterministicSource(b'seed'))(),
+            pu.UniqueCounter(source=testing.DeterministicSource(b'seed'))())
+        self.assertEqual(
+            pu.time_hash(source=testing.DeterministicSource(b'seed')),
+            pu.time_hash(source=testing.DeterministicSource(b'seed')))
+        pool = entropy.EntropyPool(source=testing.DeterministicSource(b'seed'))
+        self.assertEqual(bytes(pool.take(8)),testing.DeterministicSource(b'seed').random_bytes(4096)[:8])
+        # the default source is the OS
+        self.assertTrue(entropy.EntropyPool().source is entropy.system_source)
+        self.assertEqual(len(entropy.system_source.random_bytes(10)),10)
+        self.assertEqual(len(entropy.system_source.time_stamp()),16)
+    def test_bench(self):
+        first = bench.bench_case("single",8,"n",min_seconds=0.01,seed="seed")
+        second = bench.bench_case("single",8,"n",min_seconds=0.01,seed="seed")
+        self.assertEqual(first["digest"],second["digest"])
+        self.assertFalse("digest" in bench.bench_case("single",8,"n",min_seconds=0.01))
+        with self.assertRaises(ValueError):
+            bench.bench_case("parallel",8,"n",min_seconds=0.01,seed="seed")
+    def test_safe_failure(self):
+        with self.assertRaises(TypeError):
+            passutil.generate_password(8,"hi","z",source=b'seed')
+        with self.assertRaises(TypeError):
+            testing.DeterministicSource(5)
+        # a source missing a method should fail when it is created
+        with self.assertRaises(TypeError):
+            entropy.EntropySource()
+        class Incomplete(entropy.EntropySource):
+            def random_bytes(self,n):
+                return bytes(n)
+        with self.assertRaises(TypeError):
+            Incomplete()
+
+class Test_hash_backends(unittest.TestCase):
+    def test_all(self):
+        # every available backend should be able to
+        # generate passwords in every mode
+        for backend in passutil.hash_backends:
+            for mode in ["standard","high_yield","shake"]:
+                result = passutil.generate_password(40,"hi","n",mode=mode,backend=backend)
+                self.assertEqual(len(result),40)
+                for char in result:
+                    self.assertTrue(char in "0123456789")
+            result = passutil.generate_passwords(3,5,"hi","n",backend=backend)
+            self.assertEqual(len(result),3)
+    def test_long_key(self):
+        # blake2b keys are limited to 64 bytes,
+        # longer keys should still be accepted
+        result = passutil.generate_password(10,b'k'*1000,"n",backend="blake2b")
+        self.assertEqual(len(result),10)
+    def test_default(self):
+        # the default backend should agree with SHA512_number
+        self.assertTrue(passutil.hash_backend in passutil.hash_backends)
+        if passutil.SHA512_number == 3:
+            self.assertEqual(passutil.hash_backend,"sha3_512")
+        else:
+            self.assertEqual(passutil.hash_backend,"sha512")
+        self.assertTrue("sha512" in passutil.hash_backends)
+        self.assertTrue("blake2b" in passutil.hash_backends)
+    def test_safe_failure(self):
+        with self.assertRaises(Exception):
+            # backend should be a known backend
+            passutil.generate_password(10,"hi","n",backend="md5")
+        with self.assertRaises(Exception):
+            # backend should be a str
+            passutil.generate_password(10,"hi","n",backend=512)
+
+class Test_UniqueCounter(unittest.TestCase):
+    def test_binary(self):
+        # the counter should produce distinct 16 byte values
+        # which increase by one
+        counter = pu.UniqueCounter()
+        first = counter()
+        second = counter()
+        self.assertEqual(type(first),bytes)
+        self.assertEqual(len(first),16)
+        self.assertEqual(len(second),16)
+        self.assertEqual(
+            (int.from_bytes(first,"big") + 1) % (1 << 128),
+            int.from_bytes(second,"big"))
+    def test_wrap(self):
+        # the counter should stay 16 bytes wide at the top of its range
+        counter = pu.UniqueCounter()
+        counter.n = (1 << 128) - 1
+        self.assertEqual(counter(),b'\xff'*16)
+        self.assertEqual(counter(),b'\x00'*16)
+    def test_legacy(self):
+        # legacy counters should use the decimal encoding
+        counter = pu.UniqueCounter(legacy=True)
+        counter.n = 41
+        self.assertEqual(counter(),b'41:')
+        self.assertEqual(counter(),b'42:')
+
+class Test_HashStates(unittest.TestCase):
+    def test_absorb(self):
+        # absorbing into a prepared state should not change it,
+        # and should match hashing everything from scratch
+        for name in passutil.hash_backends:
+            backend = passutil.hash_backends[name]
+            states = pu.HashStates(b'key',backend)
+            first = pu.absorb(states.step,b'abc',b'def').digest()
+            second = pu.absorb(states.step,b'abcdef').digest()
+            self.assertEqual(first,second)
+            fresh = backend.keyed_state(b'step:',b'key')
+            fresh.update(b'abcdef')
+            self.assertEqual(first,fresh.digest())
+            self.assertEqual(len(first),64)
+    def test_domains(self):
+        # different prefixes should give different states
+        states = pu.HashStates(b'key',passutil.hash_backends["sha512"])
+        self.assertNotEqual(
+            pu.absorb(states.step,b'abc').digest(),
+            pu.absorb(states.password,b'abc').digest())
+
+class Test_EntropyPool(unittest.TestCase):
+    def test_take(self):
+        # take should return memoryviews of the requested size
+        # which never overlap
+        pool = entropy.EntropyPool()
+        seen = set()
+        for i in range(100):
+            view = pool.take(64)
+            self.assertEqual(type(view),memoryview)
+            self.assertEqual(len(view),64)
+            seen.add(bytes(view))
+        self.assertEqual(len(seen),100)
+        # 6400 bytes should need chunks of 4096 and 8192 bytes
+        self.assertEqual(pool.refills,2)
+    def test_growth(self):
+        # the chunk size should double, up to the maximum
+        pool = entropy.EntropyPool(max_chunk=16384)
+        for i in range(10):
+            pool.refill()
+        self.assertEqual(pool.chunk_size,16384)
+        self.assertEqual(len(pool.view),16384)
+    def test_large(self):
+        # requests larger than a chunk should still be satisfied
+        pool = entropy.EntropyPool()
+        self.assertEqual(len(pool.take(100000)),100000)
+        self.assertEqual(len(pool.take(10)),10)
+    @unittest.skipUnless(hasattr(os,"fork"),"needs os.fork")
+    def test_fork(self):
+        # a forked child should never hand out the bytes
+        # which its parent buffered before the fork
+        pool = entropy.EntropyPool()
+        pool.take(1)
+        child = in_child(lambda: bytes(pool.take(32)))
+        self.assertEqual(len(child),32)
+        self.assertNotEqual(child,bytes(pool.take(32)))
+        # and a generator should not share its hash chain,
+        # even with a source which gives both processes the same bytes
+        generator = passutil.PasswordGenerator("hi","z",source=testing.DeterministicSource())
+        generator.next_password(10)
+        child = in_child(lambda: generator.next_bytes(32))
+        self.assertEqual(len(child),32)
+        self.assertNotEqual(child,generator.next_bytes(32))
+    def test_time_stamp(self):
+        stamp = entropy.time_stamp()
+        self.assertEqual(type(stamp),bytes)
+        self.assertEqual(len(stamp),16)
+
+class Test_command_line(unittest.TestCase):
+    def test_single(self):
+        code, out, err = run_cli("n","12")
+        self.assertEqual(code,0)
+        self.assertEqual(len(out.strip()),12)
+        self.assertEqual(err,b'')
+    def test_count(self):
+        code, out, err = run_cli("--count","500","--hash","blake2b","h","10")
+        self.assertEqual(code,0)
+        lines = out.decode("UTF-8").split()
+        self.assertEqual(len(lines),500)
+        self.assertEqual(len(set(lines)),500)
+        for line in lines:
+            self.assertEqual(len(line),10)
+            self.assertTrue(set(line) <= set("0123456789abcdef"))
+    def test_null(self):
+        code, out, err = run_cli("--count","3","--null","n","4")
+        self.assertEqual(code,0)
+        self.assertEqual(len(out),15)
+        self.assertEqual(out.count(b'\x00'),3)
+    def test_output(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory,"out.txt")
+            code, out, err = run_cli("--count","20","--workers","2","--output",path,"h","8")
+            self.assertEqual(code,0)
+            self.assertEqual(out,b'')
+            with open(path,"rb") as file:
+                lines = file.read().split()
+            self.assertEqual(len(lines),20)
+            for line in lines:
+                self.assertEqual(len(line),8)
+    def test_errors(self):
+        # errors should go to stderr, with a nonzero exit code
+        for args in [("--count","x","z","4"),("--count","-1","z","4"),("--workers","0","z","4"),
+            ("--bogus","z","4"),("--hash","md5","z","4"),("z",),("z","x"),("e..e","4"),("z","-4")]:
+            code, out, err = run_cli(*args)
+            self.assertNotEqual(code,0)
+            self.assertEqual(out,b'')
+            self.assertTrue(len(err) > 0)
+    def test_messages(self):
+        code, out, err = run_cli("--size","n")
+        self.assertEqual(code,0)
+        self.assertEqual(out.strip(),b'10')
+
+class Test_stats(unittest.TestCase):
+    def tearDown(self):
+        passutil.disable_stats()
+        passutil.reset_stats()
+    def test_disabled(self):
+        # while disabled, the original functions should be in place
+        absorb = pu.absorb
+        extend = pu.PasswordGenerator.extend
+        passutil.enable_stats()
+        self.assertTrue(stats.stats_enabled())
+        self.assertNotEqual(pu.absorb,absorb)
+        passutil.disable_stats()
+        self.assertFalse(stats.stats_enabled())
+        self.assertEqual(pu.absorb,absorb)
+        self.assertEqual(pu.PasswordGenerator.extend,extend)
+        passutil.reset_stats()
+        passutil.generate_password(16,"hi","z")
+        self.assertEqual(set(passutil.get_stats().values()),{0})
+    def test_counts(self):
+        passutil.enable_stats()
+        passutil.generate_passwords(20,16,"hi","z")
+        result = passutil.get_stats()
+        self.assertEqual(set(result),set(stats.counter_names))
+        self.assertEqual(result["chars"],320)
+        self.assertEqual(result["extend_calls"],20)
+        # in standard mode, each candidate gives a character or a rejection
+        self.assertEqual(result["candidates"],result["chars"]+result["rejected"])
+        self.assertEqual(result["candidate_bytes"],64*result["candidates"])
+        self.assertTrue(result["hashes"] > 2*result["candidates"])
+        self.assertEqual(result["clock_calls"],result["hashes"])
+        self.assertTrue(result["random_bytes"] >= 64*result["hashes"])
+        self.assertEqual(result["charset_lookups"],1)
+        for name in ["hash_ns","random_ns","clock_ns","extend_ns","charset_ns"]:
+            self.assertTrue(result[name] > 0)
+        passutil.reset_stats()
+        self.assertEqual(set(passutil.get_stats().values()),{0})
+    def test_hook(self):
+        records = []
+        passutil.enable_stats(records.append)
+        passutil.generate_passwords(3,10,"hi","h",mode="shake",sampler="index")
+        self.assertEqual(len(records),3)
+        for record in records:
+            self.assertEqual(record["chars"],10)
+            self.assertEqual(record["mode"],"shake")
+            self.assertEqual(record["sampler"],"index")
+            self.assertEqual(record["charset_size"],16)
+            self.assertTrue(record["rejected"] >= 0)
+        with self.assertRaises(Exception):
+            passutil.enable_stats(5)
+    def test_indices(self):
+        # indices for passphrases and policies should be counted too
+        records = []
+        passutil.enable_stats(records.append)
+        generator = passutil.PasswordGenerator("hi","n")
+        extend_indices = pu.PasswordGenerator.extend_indices
+        generator.next_indices(50,7)
+        self.assertEqual(len(records),1)
+        self.assertEqual(records[0]["kind"],"indices")
+        self.assertEqual(records[0]["charset_size"],7)
+        self.assertEqual(records[0]["chars"],50)
+        result = passutil.get_stats()
+        self.assertEqual(result["chars"],50)
+        self.assertEqual(result["candidates"],result["chars"]+result["rejected"])
+        passutil.disable_stats()
+        self.assertNotEqual(pu.PasswordGenerator.extend_indices,extend_indices)
+    def test_clock(self):
+        self.assertEqual(type(stats.perf_ns()),int)
+    def test_threads(self):
+        passutil.enable_stats()
+        generator = passutil.ThreadSafeGenerator("hi","z",mode="standard")
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            list(executor.map(lambda i: generator.next_passwords(10,8),range(8)))
+        result = passutil.get_stats()
+        self.assertEqual(result["chars"],640)
+        self.assertEqual(result["candidates"],result["chars"]+result["rejected"])
+    def test_switching(self):
+        # stats may be switched on and off while other threads generate
+        # switching threads often makes the races likely
+        interval = sys.getswitchinterval()
+        sys.setswitchinterval(1e-6)
+        self.addCleanup(sys.setswitchinterval,interval)
+        absorb = pu.absorb
+        time_stamp = entropy.SystemSource.time_stamp
+        generator = passutil.ThreadSafeGenerator("hi","z",mode="standard")
+        done = threading.Event()
+        def work(i):
+            while not done.is_set():
+                generator.next_password(8)
+                generator.generator().next_indices(3,7)
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            futures = [executor.submit(work,i) for i in range(4)]
+            for i in range(5000):
+                passutil.enable_stats()
+                passutil.disable_stats()
+            done.set()
+            for future in futures:
+                future.result()
+        # threads enabling at once should all save the real functions
+        barrier = threading.Barrier(8)
+        def enable(i):
+            barrier.wait()
+            passutil.enable_stats()
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            list(executor.map(enable,range(8)))
+        passutil.disable_stats()
+        self.assertTrue(pu.absorb is absorb)
+        self.assertTrue(entropy.SystemSource.time_stamp is time_stamp)
+
+class Test_bench(unittest.TestCase):
+    def test_bench_case(self):
+        for engine in bench.engines:
+            result = bench.bench_case(engine,8,"h",min_seconds=0)
+            self.assertEqual(result["engine"],engine)
+            self.assertEqual(result["charset_size"],16)
+            self.assertEqual(result["backend"],passutil.hash_backend)
+            self.assertTrue(result["passwords"] >= 1)
+            self.assertTrue(result["chars_per_second"] > 0)
+        with self.assertRaises(Exception):
+            bench.bench_case("bogus",8,"h",min_seconds=0)
+    def test_sweep(self):
+        # every case should differ from the baseline in one parameter
+        cases = bench.sweep(charsets=("z","n"),lengths=(16,8),backends=("sha512","blake2b"),modes=("standard",),samplers=("byte","index"),engines=("generator",))
+        self.assertEqual(len(cases),5)
+        baseline = cases[0]
+        self.assertEqual(baseline,{"engine": "generator", "length": 16, "valid_chars": "z", "mode": "standard", "backend": "sha512", "sampler": "byte"})
+        for case in cases[1:]:
+            self.assertEqual(sum(case[name] != baseline[name] for name in baseline),1)
+    def test_report(self):
+        report = bench.run_benchmarks([{"engine": "generator", "length": 4, "valid_chars": "n", "mode": "batched", "backend": None, "sampler": "byte"}],0)
+        self.assertEqual(report["SHA512_number"],passutil.SHA512_number)
+        self.assertEqual(len(report["results"]),1)
+        self.assertEqual(report["results"][0]["mode"],"batched")
+
+class Test_startup(unittest.TestCase):
+    # the total import time of passutil, in microseconds,
+    # allowed for the informational commands
+    # they take about 5 ms on a typical machine,
+    # the budget leaves room for slow test machines
+    STARTUP_BUDGET_US = 50000
+    heavy = ["secrets","asyncio","concurrent.futures","multiprocessing","numpy"]
+    def passutil_time(self,times):
+        return sum(times[name] for name in times if name.split(".")[0] == "passutil" and name.count(".") <= 1)
+    def test_import(self):
+        times = import_times("-c","import passutil")
+        for name in self.heavy + ["hashlib","passutil.pu"]:
+            self.assertFalse(name in times,name)
+    def test_size(self):
+        times = import_times("-m","passutil","--size","z")
+        for name in self.heavy + ["hashlib","passutil.pu"]:
+            self.assertFalse(name in times,name)
+        self.assertTrue(self.passutil_time(times) < self.STARTUP_BUDGET_US)
+    def test_hash(self):
+        times = import_times("-m","passutil","--hash")
+        for name in self.heavy + ["passutil.pu"]:
+            self.assertFalse(name in times,name)
+        self.assertTrue("passutil.backends" in times)
+        self.assertTrue(self.passutil_time(times) < self.STARTUP_BUDGET_US)
+    def test_generate(self):
+        times = import_times("-m","passutil","z","8")
+        for name in self.heavy:
+            self.assertFalse(name in times,name)
+    def test_client(self):
+        # the client fails to connect, but only after its imports
+        times = import_times("-m","passutil","--socket",os.path.join(tempfile.gettempdir(),"missing.sock"),"z","8")
+        for name in self.heavy + ["hashlib","passutil.pu"]:
+            self.assertFalse(name in times,name)
+        self.assertTrue("passutil.client" in times)
+    def test_lazy(self):
+        # every export should resolve, and be listed by dir
+        for name in passutil.exports:
+            self.assertTrue(hasattr(passutil,name))
+            self.assertTrue(name in dir(passutil))
+        with self.assertRaises(AttributeError):
+            passutil.not_a_function
+    def test_submodules(self):
+        # submodules should be attributes of the package,
+        # even before anything has imported them
+        env = dict(os.environ)
+        env["PYTHONPATH"] = os.path.abspath("../src")
+        code = "import passutil; print(passutil.chars.Charset is passutil.Charset, passutil.pu.__name__, passutil.bench.__name__)"
+        result = subprocess.run([sys.executable,"-c",code],stdout=subprocess.PIPE,stderr=subprocess.PIPE,env=env)
+        self.assertEqual(result.stdout.split(),[b'True',b'passutil.pu',b'passutil.bench'])
+        for name in passutil.submodules:
+            self.assertTrue(name in dir(passutil))
+    def test_star(self):
+        # from passutil import * should give every public name
+        namespace = {}
+        exec("from passutil import *",namespace)
+        for name in passutil.exports:
+            self.assertTrue(name in namespace,name)
+        self.assertFalse("importlib" in namespace)
+        self.assertFalse("exports" in namespace)
 
 class Test_API(unittest.TestCase):
     # just test to make sure that API objects
@@ -358,8 +1856,27 @@ class Test_API(unittest.TestCase):
     def test_1(self):
         self.assertEqual(type(passutil.SHA512_number),int)
         self.assertTrue(passutil.SHA512_number in [2,3])
+        self.assertEqual(type(passutil.hash_backend),str)
+        self.assertEqual(type(passutil.hash_backends),dict)
         self.assertTrue(callable(passutil.generate_password))
+        self.assertTrue(callable(passutil.generate_passwords))
+        self.assertTrue(callable(passutil.PasswordGenerator))
+        self.assertTrue(callable(passutil.iter_password_chars))
+        self.assertTrue(callable(passutil.generate_password_into))
         self.assertTrue(callable(passutil.charset_size))
+        self.assertTrue(callable(passutil.rejection_rate))
+        self.assertTrue(callable(passutil.compile_charset))
+        self.assertTrue(callable(passutil.charset_cache_info))
+        self.assertTrue(callable(passutil.generate_passwords_parallel))
+        self.assertTrue(callable(passutil.iter_passwords_parallel))
+        self.assertTrue(callable(passutil.ThreadSafeGenerator))
+        self.assertTrue(callable(passutil.agenerate_password))
+        self.assertTrue(callable(passutil.agenerate_passwords))
+        self.assertTrue(callable(passutil.PasswordPool))
+        self.assertTrue(callable(passutil.enable_stats))
+        self.assertTrue(callable(passutil.get_stats))
+        self.assertTrue(callable(passutil.generate_passphrase))
+        self.assertTrue(callable(passutil.Wordlist))
 
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file